@@ -1,6 +1,7 @@
 # cython: language_level=3
 
 cimport numpy as np
+from libc.string cimport memset
 from numpy import pi
 
 
@@ -324,12 +325,109 @@ def apu_mixer(
     apu.filter3_previous_out = filter3_previous_out
 
 
+# Frame counter events (quarter and half frames), in APU ticks
+
+cdef unsigned int FRAME_COUNTER_PERIOD = 18641
+
+
+cdef inline unsigned int ticks_until_frame_event(unsigned int tick):
+    # Number of ticks after `tick` until the next event, the channel
+    # parameters are constant in between
+    if tick < 3728:
+        return 3728 - tick
+    if tick < 7456:
+        return 7456 - tick
+    if tick < 11185:
+        return 11185 - tick
+    if tick < 18640:
+        return 18640 - tick
+    return FRAME_COUNTER_PERIOD - tick + 3728
+
+
+cdef inline unsigned int advance_timer(
+    unsigned short* timer, unsigned int period, unsigned int ticks
+):
+    # Advance a timer reloaded with `period` by `ticks`,
+    # and return the number of times it has been reloaded
+    cdef unsigned int remaining, steps
+    if ticks <= timer[0]:
+        timer[0] -= ticks
+        return 0
+    remaining = ticks - timer[0] - 1
+    steps = 1 + remaining // (period + 1)
+    timer[0] = period - remaining % (period + 1)
+    return steps
+
+
+# Waveform tables
+
+cdef unsigned char[32] DUTY_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 1,
+    0, 0, 0, 0, 0, 0, 1, 1,
+    0, 0, 0, 0, 1, 1, 1, 1,
+    1, 1, 1, 1, 1, 1, 0, 0,
+]
+
+cdef unsigned char[32] TRIANGLE_TABLE = [
+    0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
+    15, 14, 13, 12, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 1, 0,
+]
+
+# Noise shift register sequences, for both modes. The shift register update
+# is a permutation of the 15-bit states, so the states are laid out cycle by
+# cycle in `LFSR_ORDER` and advancing by n steps is a lookup.
+
+cdef unsigned short[2][32768] LFSR_ORDER
+cdef unsigned short[2][32768] LFSR_POSITION
+cdef unsigned short[2][32768] LFSR_CYCLE_START
+cdef unsigned short[2][32768] LFSR_CYCLE_LENGTH
+
+
+cdef inline unsigned short lfsr_step(unsigned short state, unsigned int shift):
+    cdef unsigned short feedback = (state ^ (state >> shift)) & 0x01
+    return (state >> 1) | (feedback << 14)
+
+
+cdef void init_lfsr_tables():
+    cdef unsigned int mode, shift, state, current, start, position, i
+    for mode in range(2):
+        shift = 6 if mode else 1
+        for state in range(32768):
+            LFSR_POSITION[mode][state] = 0xFFFF
+        position = 0
+        for state in range(32768):
+            if LFSR_POSITION[mode][state] != 0xFFFF:
+                continue
+            start = position
+            current = state
+            while LFSR_POSITION[mode][current] == 0xFFFF:
+                LFSR_POSITION[mode][current] = position
+                LFSR_ORDER[mode][position] = current
+                position += 1
+                current = lfsr_step(current, shift)
+            for i in range(start, position):
+                LFSR_CYCLE_START[mode][LFSR_ORDER[mode][i]] = start
+                LFSR_CYCLE_LENGTH[mode][LFSR_ORDER[mode][i]] = position - start
+
+
+init_lfsr_tables()
+
+
+cdef inline unsigned short lfsr_advance(
+    unsigned int mode, unsigned short state, unsigned int steps
+):
+    cdef unsigned int start = LFSR_CYCLE_START[mode][state]
+    cdef unsigned int length = LFSR_CYCLE_LENGTH[mode][state]
+    cdef unsigned int offset = LFSR_POSITION[mode][state] - start
+    return LFSR_ORDER[mode][start + (offset + steps) % length]
+
+
 def generate_pulse(
     pulse,
-    np.ndarray[np.uint8_t, ndim=1] pulse_out,
+    unsigned char[::1] pulse_out,
 ):
     cdef unsigned int ticks_in_frame = len(pulse_out)
-    cdef unsigned int i, value, current_envelope
+    cdef unsigned int i, k, end, span, run, steps, value, current_envelope
 
     # Parameters
     cdef unsigned short duty = pulse.duty
@@ -356,22 +454,16 @@ def generate_pulse(
     cdef unsigned short decay_level_counter = pulse.decay_level_counter
     cdef unsigned short current_timer_period = pulse.current_timer_period
 
-    cdef unsigned char[8] sequencer_table
-
-    if duty == 0:
-        sequencer_table = [0, 0, 0, 0, 0, 0, 0, 1]
-    elif duty == 1:
-        sequencer_table = [0, 0, 0, 0, 0, 0, 1, 1]
-    elif duty == 2:
-        sequencer_table = [0, 0, 0, 0, 1, 1, 1, 1]
-    elif duty == 3:
-        sequencer_table = [1, 1, 1, 1, 1, 1, 0, 0]
-    else:
+    cdef unsigned char* sequencer_table
+
+    if duty > 3:
         assert False
+    sequencer_table = &DUTY_TABLE[duty * 8]
 
     current_envelope = volume if constant_volume else decay_level_counter
     value = sequencer_table[current_sequencer] * current_envelope
-    for i in range(ticks_in_frame):
+    i = 0
+    while i < ticks_in_frame:
         # Manage envelope
         if current_tick in (3728, 7456, 11185, 18640):
             if start_flag:
@@ -403,22 +495,39 @@ def generate_pulse(
                 sweep_divider = sweep_period
             else:
                 sweep_divider -= 1
-        # Manage frame counter
-        current_tick += 1
-        if current_tick == 18641:
-            current_tick = 0
-        # Manage timer
-        if current_timer != 0:
-            current_timer -= 1
-        else:
-            current_timer = current_timer_period
-            current_sequencer = 7 if current_sequencer == 0 else current_sequencer - 1
-            value = sequencer_table[current_sequencer] * current_envelope
-        # Manage length counter
-        if enabled and length_counter > 0 and current_timer_period >= 8:
-            pulse_out[i] = value
-        else:
-            pulse_out[i] = 0
+        # Manage frame counter, up to the next event
+        span = min(ticks_until_frame_event(current_tick), ticks_in_frame - i)
+        current_tick = (current_tick + span) % FRAME_COUNTER_PERIOD
+        end = i + span
+        # Silent span
+        if (
+            not enabled
+            or length_counter == 0
+            or current_timer_period < 8
+            or (current_envelope == 0 and value == 0)
+        ):
+            memset(&pulse_out[i], 0, span)
+            steps = advance_timer(&current_timer, current_timer_period, span)
+            if steps:
+                current_sequencer = (current_sequencer + 8 - steps % 8) % 8
+                value = sequencer_table[current_sequencer] * current_envelope
+            i = end
+            continue
+        # Fill the span with runs of constant values
+        k = i
+        while k < end:
+            if current_timer != 0:
+                run = min(current_timer, end - k)
+                memset(&pulse_out[k], value, run)
+                current_timer -= run
+                k += run
+            else:
+                current_timer = current_timer_period
+                current_sequencer = 7 if current_sequencer == 0 else current_sequencer - 1
+                value = sequencer_table[current_sequencer] * current_envelope
+                pulse_out[k] = value
+                k += 1
+        i = end
 
     pulse.start_flag = start_flag
     pulse.current_tick = current_tick
@@ -431,12 +540,40 @@ def generate_pulse(
     pulse.decay_level_counter = decay_level_counter
     pulse.current_timer_period = current_timer_period
 
+
+cdef inline unsigned short triangle_reload(
+    unsigned short timer, unsigned short load_timer
+):
+    return load_timer if timer == 1 else <unsigned short>(load_timer - 1)
+
+
+cdef unsigned short skip_triangle_timer(
+    unsigned short timer, unsigned short load_timer, unsigned int ticks
+):
+    # Advance the triangle timer by `ticks`, starting right after a reload.
+    # The timer goes through the same two reloads over and over.
+    cdef unsigned short second = triangle_reload(timer & 0x01, load_timer)
+    cdef unsigned int cycle = (timer >> 1) + 1 + (second >> 1) + 1
+    cdef unsigned int run
+    ticks %= cycle
+    while ticks > 0:
+        if timer > 1:
+            run = min(timer >> 1, ticks)
+            timer -= 2 * run
+            ticks -= run
+        else:
+            timer = triangle_reload(timer, load_timer)
+            ticks -= 1
+    return timer
+
+
 def generate_triangle(
     triangle,
-    np.ndarray[np.uint8_t, ndim=1] triangle_out,
+    unsigned char[::1] triangle_out,
 ):
     cdef unsigned int ticks_in_frame = len(triangle_out)
-    cdef unsigned int i, value
+    cdef unsigned int i, k, end, span, run
+    cdef bint stepping
 
     # Parameters
     cdef unsigned char enabled = triangle.enabled
@@ -454,12 +591,8 @@ def generate_triangle(
     cdef unsigned short current_sequencer = triangle.current_sequencer
     cdef unsigned short counter_reload_flag = triangle.counter_reload_flag
 
-    cdef unsigned char[32] sequencer_table = [
-        0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15,
-        15, 14, 13, 12, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 1, 0,
-    ]
-
-    for i in range(ticks_in_frame):
+    i = 0
+    while i < ticks_in_frame:
         # Manage volume
         if current_tick in (3728, 7456, 11185, 18640):
             if counter_reload_flag:
@@ -471,19 +604,34 @@ def generate_triangle(
         if current_tick in (7456, 18640):
             if length_counter_halt == 0 and length_counter != 0:
                 length_counter -= 1
-        # Manage frame counter
-        current_tick += 1
-        if current_tick == 18641:
-            current_tick = 0
-        # Manage timer
-        if current_timer > 1:
-            current_timer -= 2
-        else:
-            current_timer = load_timer if current_timer == 1 else load_timer - 1
-            if current_counter != 0 and load_timer >= 2 and enabled and length_counter != 0:
+        # Manage frame counter, up to the next event
+        span = min(ticks_until_frame_event(current_tick), ticks_in_frame - i)
+        current_tick = (current_tick + span) % FRAME_COUNTER_PERIOD
+        end = i + span
+        stepping = (
+            current_counter != 0 and load_timer >= 2 and enabled and length_counter != 0
+        )
+        # Fill the span with runs of constant values
+        k = i
+        while k < end:
+            if current_timer > 1:
+                run = min(current_timer >> 1, end - k)
+                memset(&triangle_out[k], current_value, run)
+                current_timer -= 2 * run
+                k += run
+                continue
+            current_timer = triangle_reload(current_timer, load_timer)
+            if stepping:
                 current_sequencer = 31 if current_sequencer == 0 else current_sequencer - 1
-            current_value = sequencer_table[current_sequencer]
-        triangle_out[i] = current_value
+            current_value = TRIANGLE_TABLE[current_sequencer]
+            triangle_out[k] = current_value
+            k += 1
+            # The sequencer is halted, the value holds until the end of the span
+            if not stepping and k < end:
+                memset(&triangle_out[k], current_value, end - k)
+                current_timer = skip_triangle_timer(current_timer, load_timer, end - k)
+                k = end
+        i = end
 
     triangle.current_value = current_value
     triangle.current_tick = current_tick
@@ -496,10 +644,10 @@ def generate_triangle(
 
 def generate_noise(
     noise,
-    np.ndarray[np.uint8_t, ndim=1] noise_out,
+    unsigned char[::1] noise_out,
 ):
     cdef unsigned int ticks_in_frame = len(noise_out)
-    cdef unsigned int i, current_envelope, shift, feedback
+    cdef unsigned int i, k, end, span, run, steps, mode, current_envelope
 
     # Parameters
     cdef unsigned short volume = noise.volume
@@ -519,9 +667,10 @@ def generate_noise(
     cdef unsigned short divider_period = noise.divider_period
     cdef unsigned short decay_level_counter = noise.decay_level_counter
 
-    shift = 6 if noise_mode else 1
+    mode = 1 if noise_mode else 0
     current_envelope = volume if constant_volume else decay_level_counter
-    for i in range(ticks_in_frame):
+    i = 0
+    while i < ticks_in_frame:
         # Manage envelope
         if current_tick in (3728, 7456, 11185, 18640):
             if start_flag:
@@ -541,23 +690,36 @@ def generate_noise(
         if current_tick in (7456, 18640):
             if length_counter_halt == 0 and length_counter != 0:
                 length_counter -= 1
-        # Manage frame counter
-        current_tick += 1
-        if current_tick == 18641:
-            current_tick = 0
-        # Manage timer
-        if current_timer != 0:
-            current_timer -= 1
-        else:
-            current_timer = noise_period
-            feedback = (shift_register ^ (shift_register >> shift)) & 0x01
-            shift_register >>= 1
-            shift_register |= feedback << 14
-        # Manage length counter
-        if enabled and (shift_register & 0x01) == 0 and length_counter != 0:
-            noise_out[i] = current_envelope
-        else:
-            noise_out[i] = 0
+        # Manage frame counter, up to the next event
+        span = min(ticks_until_frame_event(current_tick), ticks_in_frame - i)
+        current_tick = (current_tick + span) % FRAME_COUNTER_PERIOD
+        end = i + span
+        # Silent span
+        if not enabled or length_counter == 0 or current_envelope == 0:
+            memset(&noise_out[i], 0, span)
+            steps = advance_timer(&current_timer, noise_period, span)
+            if steps:
+                shift_register = lfsr_advance(mode, shift_register, steps)
+            i = end
+            continue
+        # Fill the span with runs of constant values
+        k = i
+        while k < end:
+            if current_timer != 0:
+                run = min(current_timer, end - k)
+                memset(
+                    &noise_out[k],
+                    0 if shift_register & 0x01 else current_envelope,
+                    run,
+                )
+                current_timer -= run
+                k += run
+            else:
+                current_timer = noise_period
+                shift_register = lfsr_step(shift_register, 6 if mode else 1)
+                noise_out[k] = 0 if shift_register & 0x01 else current_envelope
+                k += 1
+        i = end
 
     noise.start_flag = start_flag
     noise.current_tick = current_tick
@@ -565,4 +727,4 @@ def generate_noise(
     noise.length_counter = length_counter
     noise.shift_register = shift_register
     noise.divider_period = divider_period
-    noise.decay_level_counter = decay_level_counter
\ No newline at end of file
+    noise.decay_level_counter = decay_level_counter
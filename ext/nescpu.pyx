@@ -1,6 +1,355 @@
 # cython: language_level=3
 
-def set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic):
+from libc.stdlib cimport malloc, realloc, free
+from libc.limits cimport ULLONG_MAX
+
+import numpy as np
+
+from .nesppu import try_write_data as try_write_ppu_data
+
+
+# Addressing modes
+cdef enum:
+    IMP
+    IMM
+    REL
+    ZPG
+    ZPX
+    ZPY
+    INX
+    INY
+    ABS
+    ABX
+    ABY
+    INVALID
+
+cdef unsigned char[12] SIZES = [1, 2, 2, 2, 2, 2, 2, 2, 3, 3, 3, 1]
+cdef unsigned char[256] MODES
+cdef unsigned char[256] PAGE_PENALTIES
+
+# Base cycle count per opcode, not including page crossing and taken branches
+cdef unsigned char[256] CYCLES = [
+    7, 6, 0, 0, 0, 3, 5, 0, 3, 2, 2, 0, 0, 4, 6, 0,
+    2, 5, 0, 0, 0, 4, 6, 0, 2, 4, 0, 0, 0, 4, 7, 0,
+    6, 6, 0, 0, 3, 3, 5, 0, 4, 2, 2, 0, 4, 4, 6, 0,
+    2, 5, 0, 0, 0, 4, 6, 0, 2, 4, 0, 0, 0, 4, 7, 0,
+    6, 6, 0, 0, 0, 3, 5, 0, 3, 2, 2, 0, 3, 4, 6, 0,
+    2, 5, 0, 0, 0, 4, 6, 0, 2, 4, 0, 0, 0, 4, 7, 0,
+    6, 6, 0, 0, 0, 3, 5, 0, 4, 2, 2, 0, 5, 4, 6, 0,
+    2, 5, 0, 0, 0, 4, 6, 0, 2, 4, 0, 0, 0, 4, 7, 0,
+    0, 6, 0, 0, 3, 3, 3, 0, 2, 0, 2, 0, 4, 4, 4, 0,
+    2, 6, 0, 0, 4, 4, 4, 0, 2, 5, 2, 0, 0, 5, 0, 0,
+    2, 6, 2, 0, 3, 3, 3, 0, 2, 2, 2, 0, 4, 4, 4, 0,
+    2, 5, 0, 0, 4, 4, 4, 0, 2, 4, 2, 0, 4, 4, 4, 0,
+    2, 6, 0, 0, 3, 3, 5, 0, 2, 2, 2, 0, 4, 4, 6, 0,
+    2, 5, 0, 0, 0, 4, 6, 0, 2, 4, 0, 0, 0, 4, 7, 0,
+    2, 6, 0, 0, 3, 3, 5, 0, 2, 2, 2, 0, 4, 4, 6, 0,
+    2, 5, 0, 0, 0, 4, 6, 0, 2, 4, 0, 0, 0, 4, 7, 0,
+]
+
+IMPLIED_OPCODES = (
+    0xe8, 0xca, 0xc8, 0x88, 0x0a, 0x4a, 0x2a, 0x6a, 0xea, 0x00, 0x40, 0x60,
+    0x48, 0x68, 0x08, 0x28, 0x18, 0x38, 0x58, 0x78, 0xb8, 0xd8, 0xf8, 0xaa,
+    0x8a, 0xa8, 0x98, 0x9a, 0xba,
+)
+BYTE_OPERAND_OPCODES = (
+    0x10, 0x30, 0x50, 0x70, 0x90, 0xb0, 0xd0, 0xf0, 0x85, 0x95, 0x86, 0x96,
+    0x84, 0x94, 0x81, 0x91, 0xa9, 0xa5, 0xb5, 0xa1, 0xb1, 0xa2, 0xa6, 0xb6,
+    0xa0, 0xa4, 0xb4, 0x09, 0x05, 0x15, 0x01, 0x11, 0x29, 0x25, 0x35, 0x21,
+    0x31, 0x49, 0x45, 0x55, 0x41, 0x51, 0x69, 0x65, 0x75, 0x61, 0x71, 0xe9,
+    0xe5, 0xf5, 0xe1, 0xf1, 0xe6, 0xf6, 0xc6, 0xd6, 0x06, 0x16, 0x46, 0x56,
+    0x26, 0x36, 0x66, 0x76, 0xc9, 0xc5, 0xd5, 0xe0, 0xe4, 0xc0, 0xc4, 0x24,
+)
+WORD_OPERAND_OPCODES = (
+    0x8d, 0x9d, 0x99, 0x8e, 0x8c, 0x20, 0x4c, 0x6c, 0xad, 0xbd, 0xb9, 0xae,
+    0xbe, 0xac, 0xbc, 0xcd, 0xdd, 0xd9, 0xec, 0xcc, 0xee, 0xfe, 0xce, 0xde,
+    0x6d, 0x7d, 0x79, 0xed, 0xfd, 0xf9, 0x0d, 0x1d, 0x19, 0x2d, 0x3d, 0x39,
+    0x4d, 0x5d, 0x59, 0x0e, 0x1e, 0x4e, 0x5e, 0x2e, 0x3e, 0x6e, 0x7e, 0x2c,
+)
+BLOCK_END_OPCODES = (0x00, 0x40, 0x60, 0x20, 0x4c, 0x6c)
+# Indexed stores and read-modify-write instructions always take the extra cycle
+NO_PAGE_PENALTY_OPCODES = (0x91, 0x99, 0x9d, 0x1e, 0x3e, 0x5e, 0x7e, 0xde, 0xfe)
+
+
+cdef void init_modes():
+    cdef unsigned int opc, addressing
+    for opc in range(256):
+        MODES[opc] = INVALID
+    for opc in IMPLIED_OPCODES:
+        MODES[opc] = IMP
+    for opc in BYTE_OPERAND_OPCODES:
+        addressing = (opc & 0b00011100) >> 2
+        if opc in (0x96, 0xb6):
+            MODES[opc] = ZPY
+        elif addressing == 0x05:
+            MODES[opc] = ZPX
+        elif addressing == 0x01:
+            MODES[opc] = ZPG
+        elif (opc & 0x0f) == 0x01 and addressing == 0x00:
+            MODES[opc] = INX
+        elif (opc & 0x0f) == 0x01 and addressing == 0x04:
+            MODES[opc] = INY
+        elif (opc & 0x1f) == 0x10:
+            MODES[opc] = REL
+        else:
+            MODES[opc] = IMM
+    for opc in WORD_OPERAND_OPCODES:
+        addressing = (opc & 0b00011100) >> 2
+        if addressing == 0x06 or opc == 0xbe:
+            MODES[opc] = ABY
+        elif addressing == 0x07:
+            MODES[opc] = ABX
+        else:
+            MODES[opc] = ABS
+    for opc in range(256):
+        PAGE_PENALTIES[opc] = (
+            MODES[opc] in (INY, ABX, ABY) and opc not in NO_PAGE_PENALTY_OPCODES
+        )
+
+
+init_modes()
+
+
+# Decoded instruction
+cdef struct Entry:
+    unsigned char opcode
+    unsigned char mode
+    unsigned char size
+    unsigned char cycles
+    unsigned char page_penalty
+    unsigned short operand
+
+
+# Straight-line sequence of decoded instructions, ending with a control
+# flow instruction. Successors are chained lazily by block index.
+cdef struct Block:
+    unsigned int start
+    unsigned int stop
+    unsigned short end_pc
+    unsigned short target_pc
+    int next_block
+    int target_block
+
+
+cdef class BlockCache:
+    """Basic blocks decoded from the PRG-ROM, keyed by their start address.
+
+    The PRG-ROM is immutable so the blocks stay valid until the mapped
+    banks change, in which case `invalidate` must be called.
+    """
+
+    cdef bytes rom
+    cdef unsigned int rom_size
+    cdef int* block_at
+    cdef Entry* entries
+    cdef unsigned int entry_count
+    cdef unsigned int entry_capacity
+    cdef Block* blocks
+    cdef unsigned int block_count
+    cdef unsigned int block_capacity
+
+    def __cinit__(self, bytes rom):
+        self.rom = rom
+        self.rom_size = len(rom)
+        self.block_at = <int*>malloc(self.rom_size * sizeof(int))
+        self.entry_capacity = 1024
+        self.entries = <Entry*>malloc(self.entry_capacity * sizeof(Entry))
+        self.block_capacity = 256
+        self.blocks = <Block*>malloc(self.block_capacity * sizeof(Block))
+        if not self.block_at or not self.entries or not self.blocks:
+            raise MemoryError
+        self.invalidate()
+
+    def __dealloc__(self):
+        free(self.block_at)
+        free(self.entries)
+        free(self.blocks)
+
+    def __reduce__(self):
+        return BlockCache, (self.rom,)
+
+    def __len__(self):
+        return self.block_count
+
+    def invalidate(self):
+        cdef unsigned int offset
+        for offset in range(self.rom_size):
+            self.block_at[offset] = -1
+        self.entry_count = 0
+        self.block_count = 0
+
+    cdef int lookup(self, unsigned short pc) except -1:
+        cdef unsigned int offset = pc - 0x8000
+        if pc < 0x8000 or offset >= self.rom_size:
+            raise ValueError(f"Invalid execution address: 0x{pc:04x}")
+        if self.block_at[offset] < 0:
+            self.block_at[offset] = self.decode(offset)
+        return self.block_at[offset]
+
+    cdef int decode(self, unsigned int offset) except -1:
+        cdef unsigned char* rom = self.rom
+        cdef unsigned char opc, mode, size
+        cdef Entry* entry
+        cdef Block* block
+
+        if self.block_count == self.block_capacity:
+            self.block_capacity *= 2
+            block = <Block*>realloc(self.blocks, self.block_capacity * sizeof(Block))
+            if not block:
+                raise MemoryError
+            self.blocks = block
+        block = &self.blocks[self.block_count]
+        block.start = self.entry_count
+
+        while 1:
+            opc = rom[offset]
+            mode = MODES[opc]
+            size = SIZES[mode]
+            # Truncated instruction
+            if offset + size > self.rom_size:
+                mode = INVALID
+                size = 1
+
+            if self.entry_count == self.entry_capacity:
+                self.entry_capacity *= 2
+                entry = <Entry*>realloc(self.entries, self.entry_capacity * sizeof(Entry))
+                if not entry:
+                    raise MemoryError
+                self.entries = entry
+            entry = &self.entries[self.entry_count]
+            self.entry_count += 1
+
+            entry.opcode = opc
+            entry.mode = mode
+            entry.size = size
+            entry.cycles = CYCLES[opc]
+            entry.page_penalty = PAGE_PENALTIES[opc]
+            entry.operand = 0
+            if size >= 2:
+                entry.operand = rom[offset + 1]
+            if size == 3:
+                entry.operand |= rom[offset + 2] << 8
+            offset += size
+
+            # End of block
+            if mode in (INVALID, REL) or opc in BLOCK_END_OPCODES:
+                break
+            if offset >= self.rom_size:
+                break
+
+        block.stop = self.entry_count
+        block.end_pc = 0x8000 + offset
+        block.target_pc = block.end_pc
+        if mode == REL:
+            block.target_pc = block.end_pc + <char>entry.operand
+        elif opc in (0x20, 0x4c):
+            block.target_pc = entry.operand
+        block.next_block = -1
+        block.target_block = -1
+        self.block_count += 1
+        return self.block_count - 1
+
+
+# Execution trace record, the CPU state before each instruction
+cdef packed struct TraceRecord:
+    unsigned long long cycle_count
+    unsigned int instruction_count
+    unsigned short pc
+    unsigned char opcode
+    unsigned char a
+    unsigned char x
+    unsigned char y
+    unsigned char sp
+    unsigned char p
+
+
+TRACE_DTYPE = np.dtype(
+    [
+        ("cycle_count", "<u8"),
+        ("instruction_count", "<u4"),
+        ("pc", "<u2"),
+        ("opcode", "u1"),
+        ("a", "u1"),
+        ("x", "u1"),
+        ("y", "u1"),
+        ("sp", "u1"),
+        ("p", "u1"),
+    ]
+)
+assert TRACE_DTYPE.itemsize == sizeof(TraceRecord)
+
+
+cdef class Trace:
+    """Ring buffer of the last executed instructions, filled by `run`.
+
+    The records are written in place, without any Python call, in a
+    preallocated NumPy array using `TRACE_DTYPE`.
+    """
+
+    cdef readonly object records
+    cdef readonly unsigned int capacity
+    cdef readonly unsigned long long count
+    cdef unsigned char[::1] view
+    cdef TraceRecord* buffer
+    cdef unsigned int position
+
+    def __cinit__(self, unsigned int capacity=65536):
+        if capacity == 0:
+            raise ValueError("Trace capacity must be positive")
+        self.capacity = capacity
+        self.records = np.zeros(capacity, TRACE_DTYPE)
+        self.view = self.records.view(np.uint8)
+        self.buffer = <TraceRecord*>&self.view[0]
+        self.clear()
+
+    def __reduce__(self):
+        return Trace, (self.capacity,)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def clear(self):
+        self.count = 0
+        self.position = 0
+
+    def latest(self, count=None):
+        """Return a copy of the last `count` records, oldest first."""
+        cdef unsigned int size = len(self)
+        if count is not None:
+            size = min(size, count)
+        cdef long long stop = self.position
+        indexes = np.arange(stop - size, stop) % self.capacity
+        return self.records[indexes]
+
+    cdef inline void append(
+        self,
+        unsigned short pc,
+        unsigned char opcode,
+        unsigned char a,
+        unsigned char x,
+        unsigned char y,
+        unsigned char sp,
+        unsigned char p,
+        unsigned int instruction_count,
+        unsigned long long cycle_count,
+    ) noexcept:
+        cdef TraceRecord* record = &self.buffer[self.position]
+        record.cycle_count = cycle_count
+        record.instruction_count = instruction_count
+        record.pc = pc
+        record.opcode = opcode
+        record.a = a
+        record.x = x
+        record.y = y
+        record.sp = sp
+        record.p = p
+        self.count += 1
+        self.position += 1
+        if self.position == self.capacity:
+            self.position = 0
+
+
+def set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc):
     cpu.pc = pc
     cpu.a = a
     cpu.x = x
@@ -11,9 +360,11 @@ def set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic):
     cpu.c = c
     cpu.v = v
     cpu.instruction_count = ic
+    cpu.cycle_count = cc
 
 
-def run(cpu):
+def run(cpu, unsigned long long cycle_limit=ULLONG_MAX):
+    cdef BlockCache cache = cpu.block_cache
     cdef unsigned char* rom = cpu.rom
     cdef unsigned char* ram = cpu.ram
     cdef unsigned short pc = cpu.pc
@@ -26,703 +377,842 @@ def run(cpu):
     cdef unsigned char c = cpu.c
     cdef unsigned char v = cpu.v
     cdef unsigned int ic = cpu.instruction_count
+    cdef unsigned long long cc = cpu.cycle_count
+    cdef bint limit_reached = 0
+
+    # Tracing costs a single test per instruction when disabled
+    cdef Trace trace = cpu.trace
+    cdef bint tracing = trace is not None
+    # PPUDATA writes go straight to the PPU bus, without a callout
+    cdef object ppu = cpu.ppu
+
+    cdef Entry* entry
+    cdef Block* block
+    cdef int block_index
+    cdef int next_index
+    cdef unsigned int index
+    cdef unsigned int stop
 
-    cdef unsigned char opc
-    cdef unsigned char addressing
+    cdef unsigned char opc = 0
+    cdef unsigned char mode
     cdef unsigned char operand
     cdef unsigned short address
     cdef unsigned char value
+    cdef bint taken
 
-    # Instruction loop
+    cdef unsigned short loop_pc
+    cdef unsigned short branch_pc
+    cdef unsigned char branch_opc
+    cdef unsigned char and_mask
+    cdef unsigned char mask
+    cdef unsigned char stride
+    cdef unsigned int polls
+    cdef unsigned char loop_cycles
+    cdef unsigned char page_cross
+    cdef bint exit_when_set
+
+    # Block loop
+    block_index = cache.lookup(pc)
     while 1:
-        # Read opcode
-        ic += 1
-        opc = rom[pc - 0x8000]
-        pc += 1
+        index = cache.blocks[block_index].start
+        stop = cache.blocks[block_index].stop
 
-        # No operand
+        # Instruction loop
+        while index < stop:
+            # Cycle limit reached
+            if cc >= cycle_limit:
+                limit_reached = 1
+                break
 
-        # Increment/decrement
+            # Read decoded instruction
+            entry = &cache.entries[index]
+            if tracing:
+                trace.append(
+                    pc,
+                    entry.opcode,
+                    a,
+                    x,
+                    y,
+                    sp,
+                    (n << 7) | (v << 6) | 0x20 | (z << 1) | c,
+                    ic,
+                    cc,
+                )
+            index += 1
+            ic += 1
+            cc += entry.cycles
+            opc = entry.opcode
+            mode = entry.mode
+            pc += entry.size
 
-        # INX
-        if opc == 0xe8:
-            x += 1
-            n = x >> 7
-            z = x == 0
-            continue
-        # DEX
-        elif opc == 0xca:
-            x -= 1
-            n = x >> 7
-            z = x == 0
-            continue
-        # INY
-        elif opc == 0xc8:
-            y += 1
-            n = y >> 7
-            z = y == 0
-            continue
-        # DEY
-        elif opc == 0x88:
-            y -= 1
-            n = y >> 7
-            z = y == 0
-            continue
+            # No operand
+            if mode == IMP:
+                # Increment/decrement
 
-        # Shifting
+                # INX
+                if opc == 0xe8:
+                    x += 1
+                    n = x >> 7
+                    z = x == 0
+                    continue
+                # DEX
+                elif opc == 0xca:
+                    x -= 1
+                    n = x >> 7
+                    z = x == 0
+                    continue
+                # INY
+                elif opc == 0xc8:
+                    y += 1
+                    n = y >> 7
+                    z = y == 0
+                    continue
+                # DEY
+                elif opc == 0x88:
+                    y -= 1
+                    n = y >> 7
+                    z = y == 0
+                    continue
 
-        # ASL ACC
-        elif opc == 0x0a:
-            c = a >> 7
-            a <<= 1
-            n = a >> 7
-            z = a == 0
-            continue
-        # LSR ACC
-        elif opc == 0x4a:
-            c = a & 0x01
-            a >>= 1
-            n = a >> 7
-            z = a == 0
-            continue
-        # ROL ACC
-        elif opc == 0x2a:
-            value = c
-            c = a >> 7
-            a <<= 1
-            a |= value
-            n = a >> 7
-            z = a == 0
-            continue
-        # ROR ACC
-        elif opc == 0x6a:
-            value = c
-            c = a & 0x01
-            a >>= 1
-            a |= value << 7
-            n = a >> 7
-            z = a == 0
-            continue
+                # Shifting
 
-        # Flow control
+                # ASL ACC
+                elif opc == 0x0a:
+                    c = a >> 7
+                    a <<= 1
+                    n = a >> 7
+                    z = a == 0
+                    continue
+                # LSR ACC
+                elif opc == 0x4a:
+                    c = a & 0x01
+                    a >>= 1
+                    n = a >> 7
+                    z = a == 0
+                    continue
+                # ROL ACC
+                elif opc == 0x2a:
+                    value = c
+                    c = a >> 7
+                    a <<= 1
+                    a |= value
+                    n = a >> 7
+                    z = a == 0
+                    continue
+                # ROR ACC
+                elif opc == 0x6a:
+                    value = c
+                    c = a & 0x01
+                    a >>= 1
+                    a |= value << 7
+                    n = a >> 7
+                    z = a == 0
+                    continue
 
-        # NOP
-        elif opc == 0xea:
-            continue
-        # RTI/BRK
-        elif opc in (0x00, 0x40):
-            break
-        # RTS
-        elif opc == 0x60:
-            sp += 1
-            pc = ram[0x0100 | sp]
-            sp += 1
-            pc |= ram[0x0100 | sp] << 8
-            pc += 1
-            continue
-        # PHA
-        elif opc == 0x48:
-            ram[0x0100 | sp] = a
-            sp -= 1
-            continue
-        # PLA
-        elif opc == 0x68:
-            sp += 1
-            a = ram[0x0100 | sp]
-            n = a >> 7
-            z = a == 0  # Comment here for the nicest bug
-            continue
-        # PHP
-        elif opc == 0x08:
-            value = (n << 7) | (v << 6) | (z << 1) | (c << 0)
-            ram[0x0100 | sp] = value
-            sp -= 1
-            continue
-        # PLP
-        elif opc == 0x28:
-            sp += 1
-            value = ram[0x0100 | sp]
-            n = (value & 0x80) != 0
-            v = (value & 0x40) != 0
-            z = (value & 0x02) != 0
-            c = (value & 0x01) != 0
-            continue
+                # Flow control
 
-        # Flags
+                # NOP
+                elif opc == 0xea:
+                    continue
+                # RTI/BRK
+                elif opc in (0x00, 0x40):
+                    break
+                # RTS
+                elif opc == 0x60:
+                    sp += 1
+                    pc = ram[0x0100 | sp]
+                    sp += 1
+                    pc |= ram[0x0100 | sp] << 8
+                    pc += 1
+                    continue
+                # PHA
+                elif opc == 0x48:
+                    ram[0x0100 | sp] = a
+                    sp -= 1
+                    continue
+                # PLA
+                elif opc == 0x68:
+                    sp += 1
+                    a = ram[0x0100 | sp]
+                    n = a >> 7
+                    z = a == 0  # Comment here for the nicest bug
+                    continue
+                # PHP
+                elif opc == 0x08:
+                    value = (n << 7) | (v << 6) | (z << 1) | (c << 0)
+                    ram[0x0100 | sp] = value
+                    sp -= 1
+                    continue
+                # PLP
+                elif opc == 0x28:
+                    sp += 1
+                    value = ram[0x0100 | sp]
+                    n = (value & 0x80) != 0
+                    v = (value & 0x40) != 0
+                    z = (value & 0x02) != 0
+                    c = (value & 0x01) != 0
+                    continue
 
-        # CLC
-        elif opc == 0x18:
-            c = 0
-            continue
-        # SEC
-        elif opc == 0x38:
-            c = 1
-            continue
-        # CLI/SEI/CLV/CLD/SED
-        elif opc in (0x58, 0x78, 0xB8, 0xD8, 0xF8):
-            continue
-        # TAX
-        elif opc == 0xaa:
-            x = a
-            n = a >> 7
-            z = a == 0
-            continue
+                # Flags
 
-        # Transfer
+                # CLC
+                elif opc == 0x18:
+                    c = 0
+                    continue
+                # SEC
+                elif opc == 0x38:
+                    c = 1
+                    continue
+                # CLI/SEI/CLV/CLD/SED
+                elif opc in (0x58, 0x78, 0xB8, 0xD8, 0xF8):
+                    continue
+                # TAX
+                elif opc == 0xaa:
+                    x = a
+                    n = a >> 7
+                    z = a == 0
+                    continue
 
-        # TXA
-        elif opc == 0x8a:
-            a = x
-            n = a >> 7
-            z = a == 0
-            continue
-        # TAY
-        elif opc == 0xa8:
-            y = a
-            n = a >> 7
-            z = a == 0
-            continue
-        # TYA
-        elif opc == 0x98:
-            a = y
-            n = a >> 7
-            z = a == 0
-            continue
-        # TXS
-        elif opc == 0x9a:
-            sp = x
-            continue
-        # TSX
-        elif opc == 0xba:
-            x = sp
-            n = x >> 7
-            z = x == 0
-            continue
+                # Transfer
 
-        # Byte operand
-        operand = rom[pc - 0x8000]
-        pc += 1
+                # TXA
+                elif opc == 0x8a:
+                    a = x
+                    n = a >> 7
+                    z = a == 0
+                    continue
+                # TAY
+                elif opc == 0xa8:
+                    y = a
+                    n = a >> 7
+                    z = a == 0
+                    continue
+                # TYA
+                elif opc == 0x98:
+                    a = y
+                    n = a >> 7
+                    z = a == 0
+                    continue
+                # TXS
+                elif opc == 0x9a:
+                    sp = x
+                    continue
+                # TSX
+                elif opc == 0xba:
+                    x = sp
+                    n = x >> 7
+                    z = x == 0
+                    continue
 
-        addressing = (opc & 0b00011100) >> 2
-        # ZPY
-        if opc in (0x96, 0xb6):
-            operand += y
-            address = operand
-            value = ram[address]
-        # ZPX
-        elif addressing == 0x05:
-            operand += x
-            address = operand
-            value = ram[address]
-        # ZPG
-        elif addressing == 0x01:
-            address = operand
-            value = ram[address]
-        # INX
-        elif (opc & 0x0f) == 0x01 and addressing == 0x00:
-            operand += x
-            address = ram[operand]
-            operand += 1
-            address |= ram[operand] << 8
-            if opc == 0x81:
-                value = 0
-            elif address < 0x800:
-                value = ram[address]
-            elif address > 0x8000:
-                value = rom[address - 0x8000]
-            else:
-                set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
-                value = cpu.cpu_read(address)
-        # INY
-        elif (opc & 0x0f) == 0x01 and addressing == 0x04:
-            address = ram[operand]
-            operand += 1
-            address |= ram[operand] << 8
-            address += y
-            if opc == 0x91:
-                value = 0
-            elif address < 0x800:
-                value = ram[address]
-            elif address > 0x8000:
-                value = rom[address - 0x8000]
-            else:
-                set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
-                value = cpu.cpu_read(address)
-        # IMM / REL
-        else:
-            address = 0
-            value = operand
+            # Branching
+            elif mode == REL:
+                value = entry.operand
+                # BPL
+                if opc == 0x10:
+                    taken = not n
+                # BMI
+                elif opc == 0x30:
+                    taken = n
+                # BVC
+                elif opc == 0x50:
+                    taken = not v
+                # BVS
+                elif opc == 0x70:
+                    taken = v
+                # BCC
+                elif opc == 0x90:
+                    taken = not c
+                # BCS
+                elif opc == 0xB0:
+                    taken = c
+                # BNE
+                elif opc == 0xd0:
+                    taken = not z
+                # BEQ
+                else:
+                    taken = z
+                if taken:
+                    # Branch to self, the flags can't change anymore
+                    if value == 0xfe:
+                        pc -= 2
+                        # Report as an infinite loop
+                        opc = 0x4c
+                        break
+                    address = pc + <char>value
+                    cc += 1 + (((address ^ pc) & 0xff00) != 0)
+                    pc = address
+                continue
 
-        # Branching
+            # Byte operand
+            elif mode in (IMM, ZPG, ZPX, ZPY, INX, INY):
+                operand = entry.operand
 
-        # BPL
-        if opc == 0x10:
-            if not n:
-                pc += <char>value
-            continue
-        # BMI
-        elif opc == 0x30:
-            if n:
-                pc += <char>value
-            continue
-        # BNE
-        elif opc == 0xd0:
-            if not z:
-                pc += <char>value
-            continue
-        # BEQ
-        elif opc == 0xf0:
-            if z:
-                pc += <char>value
-            continue
-        # BCC
-        elif opc == 0x90:
-            if not c:
-                pc += <char>value
-            continue
-        # BCS
-        elif opc == 0xB0:
-            if c:
-                pc += <char>value
-            continue
-        # BVC
-        elif opc == 0x50:
-            if not v:
-                pc += <char>value
-            continue
-        # BVS
-        elif opc == 0x70:
-            if v:
-                pc += <char>value
-            continue
+                # ZPY
+                if mode == ZPY:
+                    operand += y
+                    address = operand
+                    value = ram[address]
+                # ZPX
+                elif mode == ZPX:
+                    operand += x
+                    address = operand
+                    value = ram[address]
+                # ZPG
+                elif mode == ZPG:
+                    address = operand
+                    value = ram[address]
+                # INX
+                elif mode == INX:
+                    operand += x
+                    address = ram[operand]
+                    operand += 1
+                    address |= ram[operand] << 8
+                    if opc == 0x81:
+                        value = 0
+                    elif address < 0x800:
+                        value = ram[address]
+                    elif address > 0x8000:
+                        value = rom[address - 0x8000]
+                    else:
+                        set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                        value = cpu.cpu_read(address)
+                # INY
+                elif mode == INY:
+                    address = ram[operand]
+                    operand += 1
+                    address |= ram[operand] << 8
+                    address += y
+                    if entry.page_penalty and ((address - y) ^ address) & 0xff00:
+                        cc += 1
+                    if opc == 0x91:
+                        value = 0
+                    elif address < 0x800:
+                        value = ram[address]
+                    elif address > 0x8000:
+                        value = rom[address - 0x8000]
+                    else:
+                        set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                        value = cpu.cpu_read(address)
+                # IMM
+                else:
+                    address = 0
+                    value = operand
 
-        # Store
+                # Store
 
-        # STA ZPG/ZPX
-        elif opc in (0x85, 0x95):
-            ram[address] = a
-            continue
-        # STX ZPG
-        elif opc in (0x86, 0x96):
-            ram[address] = x
-            continue
-        # STY ZPG
-        elif opc in (0x84, 0x94):
-            ram[address] = y
-            continue
-        # STA INX/INY
-        elif opc in (0x81, 0x91):
-            if address < 0x800:
-                ram[address] = a
-            else:
-                set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
-                cpu.cpu_write(address, a)
-            continue
+                # STA ZPG/ZPX
+                if opc in (0x85, 0x95):
+                    ram[address] = a
+                    continue
+                # STX ZPG
+                elif opc in (0x86, 0x96):
+                    ram[address] = x
+                    continue
+                # STY ZPG
+                elif opc in (0x84, 0x94):
+                    ram[address] = y
+                    continue
+                # STA INX/INY
+                elif opc in (0x81, 0x91):
+                    if address < 0x800:
+                        ram[address] = a
+                    else:
+                        set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                        cpu.cpu_write(address, a)
+                    continue
 
-        # Load
+                # Load
 
-        # LDA IMM/ZPG/ZPX/INX/INY
-        elif opc in (0xa9, 0xa5, 0xb5, 0xa1, 0xb1):
-            a = value
-            n = (a & 0x80) != 0
-            z = a == 0
-            continue
-        # LDX IMM/ZPG/ZPY
-        elif opc in (0xa2, 0xa6, 0xb6):
-            x = value
-            n = (x & 0x80) != 0
-            z = x == 0
-            continue
-        # LDY IMM/ZPG/ZPX
-        elif opc in (0xa0, 0xa4, 0xb4):
-            y = value
-            n = (y & 0x80) != 0
-            z = y == 0
-            continue
+                # LDA IMM/ZPG/ZPX/INX/INY
+                elif opc in (0xa9, 0xa5, 0xb5, 0xa1, 0xb1):
+                    a = value
+                    n = (a & 0x80) != 0
+                    z = a == 0
+                    continue
+                # LDX IMM/ZPG/ZPY
+                elif opc in (0xa2, 0xa6, 0xb6):
+                    x = value
+                    n = (x & 0x80) != 0
+                    z = x == 0
+                    continue
+                # LDY IMM/ZPG/ZPX
+                elif opc in (0xa0, 0xa4, 0xb4):
+                    y = value
+                    n = (y & 0x80) != 0
+                    z = y == 0
+                    continue
 
-        # Bitwise operation
+                # Bitwise operation
 
-        # ORA IMM/ZPG/ZPX/INX/INY
-        elif opc in (0x09, 0x05, 0x15, 0x01, 0x11):
-            a |= value
-            n = (a & 0x80) != 0
-            z = a == 0
-            continue
-        # AND IMM/ZPG/ZPX/INX/INY
-        elif opc in (0x29, 0x25, 0x35, 0x21, 0x31):
-            a &= value
-            n = (a & 0x80) != 0
-            z = a == 0
-            continue
-        # EOR IMM/ZPG/ZPX/INX/INY
-        elif opc in (0x49, 0x45, 0x55, 0x41, 0x51):
-            a ^= value
-            n = (a & 0x80) != 0
-            z = a == 0
-            continue
+                # ORA IMM/ZPG/ZPX/INX/INY
+                elif opc in (0x09, 0x05, 0x15, 0x01, 0x11):
+                    a |= value
+                    n = (a & 0x80) != 0
+                    z = a == 0
+                    continue
+                # AND IMM/ZPG/ZPX/INX/INY
+                elif opc in (0x29, 0x25, 0x35, 0x21, 0x31):
+                    a &= value
+                    n = (a & 0x80) != 0
+                    z = a == 0
+                    continue
+                # EOR IMM/ZPG/ZPX/INX/INY
+                elif opc in (0x49, 0x45, 0x55, 0x41, 0x51):
+                    a ^= value
+                    n = (a & 0x80) != 0
+                    z = a == 0
+                    continue
 
-        # Arithmetic operation
-
-        # ADC/SBC IMM/ZPG/ZPX/INX/INY
-        elif opc in (0x69, 0x65, 0x75, 0x61, 0x71, 0xe9, 0xe5, 0xf5, 0xe1, 0xf1):
-            # Invert for SBC
-            if opc in (0xe9, 0xe5, 0xf5, 0xe1, 0xf1):
-                value = ~value
-            # Save signs of operand
-            n = a >> 8
-            z = value >> 8
-            # Add carry
-            a += c
-            c = a < c
-            # Add value
-            a += value
-            c |= a < value
-            # Compute overflow
-            v = a >> 8
-            v = (v ^ n) & (v ^ z)
-            # Set N and Z
-            n = (a & 0x80) != 0
-            z = a == 0
-            continue
+                # Arithmetic operation
 
+                # ADC/SBC IMM/ZPG/ZPX/INX/INY
+                elif opc in (0x69, 0x65, 0x75, 0x61, 0x71, 0xe9, 0xe5, 0xf5, 0xe1, 0xf1):
+                    # Invert for SBC
+                    if opc in (0xe9, 0xe5, 0xf5, 0xe1, 0xf1):
+                        value = ~value
+                    # Save signs of operand
+                    n = a >> 8
+                    z = value >> 8
+                    # Add carry
+                    a += c
+                    c = a < c
+                    # Add value
+                    a += value
+                    c |= a < value
+                    # Compute overflow
+                    v = a >> 8
+                    v = (v ^ n) & (v ^ z)
+                    # Set N and Z
+                    n = (a & 0x80) != 0
+                    z = a == 0
+                    continue
 
-        # Increment / decrement
 
-        # INC ZPG/ZPX
-        elif opc in (0xe6, 0xf6):
-            value += 1
-            n = (value & 0x80) != 0
-            z = value == 0
-            ram[address] = value
-            continue
-        # DEC ZPG/ZPX
-        elif opc in (0xc6, 0xd6):
-            value -= 1
-            n = (value & 0x80) != 0
-            z = value == 0
-            ram[address] = value
-            continue
+                # Increment / decrement
 
-        # Shifting
+                # INC ZPG/ZPX
+                elif opc in (0xe6, 0xf6):
+                    value += 1
+                    n = (value & 0x80) != 0
+                    z = value == 0
+                    ram[address] = value
+                    continue
+                # DEC ZPG/ZPX
+                elif opc in (0xc6, 0xd6):
+                    value -= 1
+                    n = (value & 0x80) != 0
+                    z = value == 0
+                    ram[address] = value
+                    continue
 
-        # ASL ZPG
-        elif opc in (0x06, 0x16):
-            c = value >> 7
-            value <<= 1
-            n = value >> 7
-            z = value == 0
-            ram[address] = value
-            continue
-        # LSR ZPG
-        elif opc in (0x46, 0x56):
-            c = value & 0x01
-            value >>= 1
-            n = value >> 7
-            z = value == 0
-            ram[address] = value
-            continue
-        # ROL ZPG
-        elif opc in (0x26, 0x36):
-            n = c
-            c = value >> 7
-            value <<= 1
-            value |= n
-            n = value >> 7
-            z = value == 0
-            ram[address] = value
-            continue
-        # ROR ZPG
-        elif opc in (0x66, 0x76):
-            n = c
-            c = value & 0x01
-            value >>= 1
-            value |= n << 7
-            n = value >> 7
-            z = value == 0
-            ram[address] = value
-            continue
+                # Shifting
 
-        # Comparison
+                # ASL ZPG
+                elif opc in (0x06, 0x16):
+                    c = value >> 7
+                    value <<= 1
+                    n = value >> 7
+                    z = value == 0
+                    ram[address] = value
+                    continue
+                # LSR ZPG
+                elif opc in (0x46, 0x56):
+                    c = value & 0x01
+                    value >>= 1
+                    n = value >> 7
+                    z = value == 0
+                    ram[address] = value
+                    continue
+                # ROL ZPG
+                elif opc in (0x26, 0x36):
+                    n = c
+                    c = value >> 7
+                    value <<= 1
+                    value |= n
+                    n = value >> 7
+                    z = value == 0
+                    ram[address] = value
+                    continue
+                # ROR ZPG
+                elif opc in (0x66, 0x76):
+                    n = c
+                    c = value & 0x01
+                    value >>= 1
+                    value |= n << 7
+                    n = value >> 7
+                    z = value == 0
+                    ram[address] = value
+                    continue
 
-        # CMP IMM/ZPG/ZPX
-        elif opc in (0xc9, 0xc5, 0xd5):
-            c = a >= value
-            value = a - value
-            n = (value & 0x80) != 0
-            z = value == 0
-            continue
-        # CPX IMM/ZPG
-        elif opc in (0xe0, 0xe4):
-            c = x >= value
-            value = x - value
-            n = (value & 0x80) != 0
-            z = value == 0
-            continue
-        # CPY IMM/ZPG
-        elif opc in (0xc0, 0xc4):
-            c = y >= value
-            value = y - value
-            n = (value & 0x80) != 0
-            z = value == 0
-            continue
-        # BIT ZPG
-        elif opc == 0x24:
-            z = (a & value) == 0
-            n = (value & 0x80) != 0
-            v = (value & 0x40) != 0
-            continue
+                # Comparison
 
-        # Word operand
-        address = (rom[pc - 0x8000] << 8) | operand
-        pc += 1
+                # CMP IMM/ZPG/ZPX
+                elif opc in (0xc9, 0xc5, 0xd5):
+                    c = a >= value
+                    value = a - value
+                    n = (value & 0x80) != 0
+                    z = value == 0
+                    continue
+                # CPX IMM/ZPG
+                elif opc in (0xe0, 0xe4):
+                    c = x >= value
+                    value = x - value
+                    n = (value & 0x80) != 0
+                    z = value == 0
+                    continue
+                # CPY IMM/ZPG
+                elif opc in (0xc0, 0xc4):
+                    c = y >= value
+                    value = y - value
+                    n = (value & 0x80) != 0
+                    z = value == 0
+                    continue
+                # BIT ZPG
+                elif opc == 0x24:
+                    z = (a & value) == 0
+                    n = (value & 0x80) != 0
+                    v = (value & 0x40) != 0
+                    continue
 
-        # ABX and ABY
-        if addressing == 0x06 or opc == 0xbe:
-            address += y
-        elif addressing == 0x07:
-            address += x
+            # Word operand
+            elif mode in (ABS, ABX, ABY):
+                address = entry.operand
 
-        # Store
+                # ABX and ABY
+                if mode == ABY:
+                    address += y
+                elif mode == ABX:
+                    address += x
+                if entry.page_penalty and (address ^ entry.operand) & 0xff00:
+                    cc += 1
 
-        # STA ABS/ABX/ABY
-        if opc in (0x8d, 0x9d, 0x99):
-            if address < 0x800:
-                ram[address] = a
-            else:
-                set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
-                cpu.cpu_write(address, a)
-            continue
-        # STX ABS
-        if opc == 0x8e:
-            if address < 0x800:
-                ram[address] = x
-            else:
-                set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
-                cpu.cpu_write(address, x)
-            continue
-        # STY ABS
-        if opc == 0x8c:
-            if address < 0x800:
-                ram[address] = y
-            else:
-                set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
-                cpu.cpu_write(address, y)
-            continue
+                # Store
 
-        # Flow control
+                # STA ABS/ABX/ABY
+                if opc in (0x8d, 0x9d, 0x99):
+                    if address < 0x800:
+                        ram[address] = a
+                    elif address == 0x2007 and try_write_ppu_data(ppu, a):
+                        pass
+                    else:
+                        # OAM DMA suspends the CPU
+                        if address == 0x4014:
+                            cc += 513
+                        set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                        cpu.cpu_write(address, a)
+                    continue
+                # STX ABS
+                if opc == 0x8e:
+                    if address < 0x800:
+                        ram[address] = x
+                    elif address == 0x2007 and try_write_ppu_data(ppu, x):
+                        pass
+                    else:
+                        set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                        cpu.cpu_write(address, x)
+                    continue
+                # STY ABS
+                if opc == 0x8c:
+                    if address < 0x800:
+                        ram[address] = y
+                    elif address == 0x2007 and try_write_ppu_data(ppu, y):
+                        pass
+                    else:
+                        set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                        cpu.cpu_write(address, y)
+                    continue
 
-        # JSR
-        elif opc == 0x20:
-            pc -= 1
-            ram[0x0100 | sp] = pc >> 8
-            sp -= 1
-            ram[0x0100 | sp] = pc & 0xff
-            sp -= 1
-            pc = address
-            continue
-        # JMP
-        elif opc == 0x4c:
-            if pc == address + 3:
-                pc = address
-                break
-            pc = address
-            continue
-        # JMP IND
-        elif opc == 0x6c:
-            if address < 0x800:
-                value = ram[address]
-            elif address >= 0x8000:
-                value = rom[address - 0x8000]
-            else:
-                set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
-                value = cpu.cpu_read(address)
-            address += 1
-            if address < 0x800:
-                pc = (ram[address] << 8) | value
-            elif address >= 0x8000:
-                pc = (rom[address - 0x8000] << 8) | value
-            else:
-                set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
-                pc = (rom[cpu.cpu_read(address)] << 8) | value
-            continue
+                # Flow control
 
-        # Get value at absolute address
-        if address < 0x800:
-            value = ram[address]
-        elif address >= 0x8000:
-            value = rom[address - 0x8000]
-        else:
-            set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
-            value = cpu.cpu_read(address)
+                # JSR
+                elif opc == 0x20:
+                    pc -= 1
+                    ram[0x0100 | sp] = pc >> 8
+                    sp -= 1
+                    ram[0x0100 | sp] = pc & 0xff
+                    sp -= 1
+                    pc = address
+                    continue
+                # JMP
+                elif opc == 0x4c:
+                    if pc == address + 3:
+                        pc = address
+                        break
+                    pc = address
+                    continue
+                # JMP IND
+                elif opc == 0x6c:
+                    if address < 0x800:
+                        value = ram[address]
+                    elif address >= 0x8000:
+                        value = rom[address - 0x8000]
+                    else:
+                        set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                        value = cpu.cpu_read(address)
+                    address += 1
+                    if address < 0x800:
+                        pc = (ram[address] << 8) | value
+                    elif address >= 0x8000:
+                        pc = (rom[address - 0x8000] << 8) | value
+                    else:
+                        set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                        pc = (rom[cpu.cpu_read(address)] << 8) | value
+                    continue
 
-        # Load
+                # PPUSTATUS polling loop (BIT/LDA, optional AND IMM, branch back)
+                if address == 0x2002 and opc in (0x2c, 0xad) and pc < 0xfffc:
+                    loop_pc = pc - 3
+                    branch_pc = pc
+                    and_mask = 0xff
+                    stride = 2
+                    if opc == 0xad and rom[pc - 0x8000] == 0x29:
+                        and_mask = rom[pc - 0x8000 + 1]
+                        branch_pc += 2
+                        stride = 3
+                    branch_opc = rom[branch_pc - 0x8000]
+                    if (
+                        (branch_opc & 0x1f) == 0x10
+                        and branch_opc not in (0x90, 0xb0)
+                        and (opc == 0x2c or branch_opc not in (0x50, 0x70))
+                        and <unsigned short>(branch_pc + 2 + <char>rom[branch_pc - 0x8000 + 1]) == loop_pc
+                    ):
+                        # BNE/BEQ test Z, i.e. the masked status value
+                        if (branch_opc & 0xc0) == 0xc0:
+                            mask = a if opc == 0x2c else and_mask
+                            exit_when_set = (branch_opc & 0x20) != 0
+                        # BVC/BVS test V, i.e. bit 6 of the status value
+                        elif (branch_opc & 0xc0) == 0x40:
+                            mask = 0x40
+                            exit_when_set = (branch_opc & 0x20) == 0
+                        # BPL/BMI test N, i.e. bit 7 of the (masked) status value
+                        else:
+                            mask = 0x80 if opc == 0x2c else and_mask & 0x80
+                            exit_when_set = (branch_opc & 0x20) == 0
+                        # Resolve the whole loop in a single call
+                        set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                        value, polls = cpu.ppu.poll_status(cpu, mask, exit_when_set, stride)
+                        ic += polls * stride - 1
+                        # Every iteration but the last one takes the branch
+                        page_cross = ((branch_pc + 2) ^ loop_pc) & 0xff00 != 0
+                        loop_cycles = 4 + (stride - 2) * 2 + 3 + page_cross
+                        cc += polls * loop_cycles - 4
+                        # Registers and flags as left by the last iteration
+                        if opc == 0x2c:
+                            z = (a & value) == 0
+                            n = (value & 0x80) != 0
+                            v = (value & 0x40) != 0
+                        else:
+                            a = value & and_mask
+                            n = a >> 7
+                            z = a == 0
+                        if ((value & mask) != 0) == exit_when_set:
+                            pc = branch_pc + 2
+                            cc -= 1 + page_cross
+                        else:
+                            pc = loop_pc
+                        # Leave the current block
+                        index = stop
+                        continue
 
-        # LDA ABS/ABX/ABY
-        if opc in (0xad, 0xbd, 0xb9):
-            a = value
-            n = value >> 7
-            z = value == 0
-            continue
-        # LDX ABS/ABY
-        elif opc in (0xae, 0xbe):
-            x = value
-            n = value >> 7
-            z = value == 0
-            continue
-        # LDY ABS/ABX
-        elif opc in (0xac, 0xbc):
-            y = value
-            n = value >> 7
-            z = value == 0
-            continue
-        # CMP ABS/ABX/ABY
-        elif opc in (0xcd, 0xdd, 0xd9):
-            c = a >= value
-            value = a - value
-            n = (value & 0x80) != 0
-            z = value == 0
-            continue
-        # CPX ABS
-        elif opc == 0xec:
-            c = x >= value
-            value = x - value
-            n = (value & 0x80) != 0
-            z = value == 0
-            continue
-        # CPY ABS
-        elif opc == 0xcc:
-            c = y >= value
-            value = y - value
-            n = (value & 0x80) != 0
-            z = value == 0
-            continue
-        # INC ABS/ABX
-        elif opc in (0xee, 0xfe):
-            value += 1
-            n = (value & 0x80) != 0
-            z = value == 0
-            if address < 0x800:
-                ram[address] = value
-            else:
-                set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
-                cpu.cpu_write(address, value)
-            continue
-        # DEC ABS/ABX
-        elif opc in (0xce, 0xde):
-            value -= 1
-            n = (value & 0x80) != 0
-            z = value == 0
-            if address < 0x800:
-                ram[address] = value
-            else:
-                set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
-                cpu.cpu_write(address, value)
-            continue
-        # ADC/SBC ABS/ABX/ABY
-        elif opc in (0x6d, 0x7d, 0x79, 0xed, 0xfd, 0xf9):
-            # Invert for SBC
-            if opc in ((0xed, 0xfd, 0xf9)):
-                value = ~value
-            # Save signs of operand
-            n = a >> 8
-            z = value >> 8
-            # Add carry
-            a += c
-            c = a < c
-            # Add value
-            a += value
-            c |= a < value
-            # Compute overflow
-            v = a >> 8
-            v = (v ^ n) & (v ^ z)
-            # Set N and Z
-            n = (a & 0x80) != 0
-            z = a == 0
-            continue
-        # ORA ABS/ABX/ABY
-        elif opc in (0x0d, 0x1d, 0x19):
-            a |= value
-            n = (a & 0x80) != 0
-            z = a == 0
-            continue
-        # AND ABS/ABX/ABY
-        elif opc in (0x2d, 0x3d, 0x39):
-            a &= value
-            n = (a & 0x80) != 0
-            z = a == 0
-            continue
-        # EOR ABS/ABX/ABY
-        elif opc in (0x4d, 0x5d, 0x59):
-            a ^= value
-            n = (a & 0x80) != 0
-            z = a == 0
-            continue
-        # ASL ABS
-        elif opc in (0x0e, 0x1e):
-            c = value >> 7
-            value <<= 1
-            n = value >> 7
-            z = value == 0
-            if address < 0x800:
-                ram[address] = value
-            else:
-                set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
-                cpu.cpu_write(address, value)
-            continue
-        # LSR ABS
-        elif opc in (0x4e, 0x5e):
-            c = value & 0x01
-            value >>= 1
-            n = value >> 7
-            z = value == 0
-            if address < 0x800:
-                ram[address] = value
-            else:
-                set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
-                cpu.cpu_write(address, value)
-            continue
-        # ROL ABS
-        elif opc in (0x2e, 0x3e):
-            n = c
-            c = value >> 7
-            value <<= 1
-            value |= n
-            n = value >> 7
-            z = value == 0
-            if address < 0x800:
-                ram[address] = value
-            else:
-                set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
-                cpu.cpu_write(address, value)
-            continue
-        # ROR ABS
-        elif opc in (0x6e, 0x7e):
-            n = c
-            c = value & 0x01
-            value >>= 1
-            value |= n << 7
-            n = value >> 7
-            z = value == 0
-            if address < 0x800:
-                ram[address] = value
+                # Get value at absolute address
+                if address < 0x800:
+                    value = ram[address]
+                elif address >= 0x8000:
+                    value = rom[address - 0x8000]
+                else:
+                    set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                    value = cpu.cpu_read(address)
+
+                # Load
+
+                # LDA ABS/ABX/ABY
+                if opc in (0xad, 0xbd, 0xb9):
+                    a = value
+                    n = value >> 7
+                    z = value == 0
+                    continue
+                # LDX ABS/ABY
+                elif opc in (0xae, 0xbe):
+                    x = value
+                    n = value >> 7
+                    z = value == 0
+                    continue
+                # LDY ABS/ABX
+                elif opc in (0xac, 0xbc):
+                    y = value
+                    n = value >> 7
+                    z = value == 0
+                    continue
+                # CMP ABS/ABX/ABY
+                elif opc in (0xcd, 0xdd, 0xd9):
+                    c = a >= value
+                    value = a - value
+                    n = (value & 0x80) != 0
+                    z = value == 0
+                    continue
+                # CPX ABS
+                elif opc == 0xec:
+                    c = x >= value
+                    value = x - value
+                    n = (value & 0x80) != 0
+                    z = value == 0
+                    continue
+                # CPY ABS
+                elif opc == 0xcc:
+                    c = y >= value
+                    value = y - value
+                    n = (value & 0x80) != 0
+                    z = value == 0
+                    continue
+                # INC ABS/ABX
+                elif opc in (0xee, 0xfe):
+                    value += 1
+                    n = (value & 0x80) != 0
+                    z = value == 0
+                    if address < 0x800:
+                        ram[address] = value
+                    else:
+                        set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                        cpu.cpu_write(address, value)
+                    continue
+                # DEC ABS/ABX
+                elif opc in (0xce, 0xde):
+                    value -= 1
+                    n = (value & 0x80) != 0
+                    z = value == 0
+                    if address < 0x800:
+                        ram[address] = value
+                    else:
+                        set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                        cpu.cpu_write(address, value)
+                    continue
+                # ADC/SBC ABS/ABX/ABY
+                elif opc in (0x6d, 0x7d, 0x79, 0xed, 0xfd, 0xf9):
+                    # Invert for SBC
+                    if opc in ((0xed, 0xfd, 0xf9)):
+                        value = ~value
+                    # Save signs of operand
+                    n = a >> 8
+                    z = value >> 8
+                    # Add carry
+                    a += c
+                    c = a < c
+                    # Add value
+                    a += value
+                    c |= a < value
+                    # Compute overflow
+                    v = a >> 8
+                    v = (v ^ n) & (v ^ z)
+                    # Set N and Z
+                    n = (a & 0x80) != 0
+                    z = a == 0
+                    continue
+                # ORA ABS/ABX/ABY
+                elif opc in (0x0d, 0x1d, 0x19):
+                    a |= value
+                    n = (a & 0x80) != 0
+                    z = a == 0
+                    continue
+                # AND ABS/ABX/ABY
+                elif opc in (0x2d, 0x3d, 0x39):
+                    a &= value
+                    n = (a & 0x80) != 0
+                    z = a == 0
+                    continue
+                # EOR ABS/ABX/ABY
+                elif opc in (0x4d, 0x5d, 0x59):
+                    a ^= value
+                    n = (a & 0x80) != 0
+                    z = a == 0
+                    continue
+                # ASL ABS
+                elif opc in (0x0e, 0x1e):
+                    c = value >> 7
+                    value <<= 1
+                    n = value >> 7
+                    z = value == 0
+                    if address < 0x800:
+                        ram[address] = value
+                    else:
+                        set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                        cpu.cpu_write(address, value)
+                    continue
+                # LSR ABS
+                elif opc in (0x4e, 0x5e):
+                    c = value & 0x01
+                    value >>= 1
+                    n = value >> 7
+                    z = value == 0
+                    if address < 0x800:
+                        ram[address] = value
+                    else:
+                        set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                        cpu.cpu_write(address, value)
+                    continue
+                # ROL ABS
+                elif opc in (0x2e, 0x3e):
+                    n = c
+                    c = value >> 7
+                    value <<= 1
+                    value |= n
+                    n = value >> 7
+                    z = value == 0
+                    if address < 0x800:
+                        ram[address] = value
+                    else:
+                        set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                        cpu.cpu_write(address, value)
+                    continue
+                # ROR ABS
+                elif opc in (0x6e, 0x7e):
+                    n = c
+                    c = value & 0x01
+                    value >>= 1
+                    value |= n << 7
+                    n = value >> 7
+                    z = value == 0
+                    if address < 0x800:
+                        ram[address] = value
+                    else:
+                        set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+                        cpu.cpu_write(address, value)
+                    continue
+                # BIT ABS
+                elif opc == 0x2c:
+                    z = (a & value) == 0
+                    n = (value & 0x80) != 0
+                    v = (value & 0x40) != 0
+                    continue
+
+            # Opcode not supported
+            pc -= entry.size
+            ic -= 1
+            break
+        else:
+            # Chain to the next block
+            block = &cache.blocks[block_index]
+            if pc == block.end_pc:
+                next_index = block.next_block
+                if next_index < 0:
+                    next_index = cache.lookup(pc)
+                    cache.blocks[block_index].next_block = next_index
+            elif pc == block.target_pc:
+                next_index = block.target_block
+                if next_index < 0:
+                    next_index = cache.lookup(pc)
+                    cache.blocks[block_index].target_block = next_index
             else:
-                set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
-                cpu.cpu_write(address, value)
-            continue
-        # BIT ABS
-        elif opc == 0x2c:
-            z = (a & value) == 0
-            n = (value & 0x80) != 0
-            v = (value & 0x40) != 0
+                next_index = cache.lookup(pc)
+            block_index = next_index
             continue
-
-        # Opcode not supported
-        pc -= 3
-        ic -= 1
         break
 
     # Set the value back to the CPU instance
-    set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic)
+    set_cpu_attributes(cpu, pc, a, x, y, sp, n, z, c, v, ic, cc)
+
+    # Cycle limit reached, execution can be resumed
+    if limit_reached:
+        return -1
 
     # Except RTI or JMP
     if opc not in (0x40, 0x4c):
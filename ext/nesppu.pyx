@@ -1,6 +1,7 @@
 # cython: language_level=3
 
 cimport numpy as np
+from libc.string cimport memcmp
 
 cdef unsigned int[64] COLORMAP = [
     0x545454,
@@ -117,4 +118,368 @@ def render_tile(char* rom, unsigned short address, char[3] colors, np.ndarray[np
                 destination[x, y] = 0
             else:
                 color = colors[color_index - 1]
-                destination[x, y] = COLORMAP[color] | <unsigned int>0xff000000
\ No newline at end of file
+                destination[x, y] = COLORMAP[color] | <unsigned int>0xff000000
+
+
+def render_scaled_tile(
+    char* rom,
+    unsigned short address,
+    char[3] colors,
+    np.ndarray[np.uint32_t, ndim=2] destination,
+    unsigned char scale,
+):
+    # Render a tile downscaled by `scale` (2, 4 or 8). Each output pixel takes
+    # the most frequent color of its block, so the output only contains
+    # palette colors. Ties favor opaque colors to keep thin lines visible.
+    cdef unsigned char[8][8] indexes
+    cdef unsigned int[4] counts
+    cdef unsigned char x, y, i, j, lower_value, higher_value, best
+    cdef unsigned char size = 8 // scale
+
+    if scale not in (2, 4, 8):
+        raise ValueError(f"Invalid scale: {scale}")
+    if destination.shape[0] < size or destination.shape[1] < size:
+        raise ValueError("Destination is too small")
+
+    for x in range(8):
+        lower_value = rom[address + x]
+        higher_value = rom[address + x + 8]
+        for y in range(8):
+            indexes[x][y] = ((lower_value >> (7 - y)) & 0x01) | (
+                ((higher_value >> (7 - y)) & 0x01) << 1
+            )
+
+    for x in range(size):
+        for y in range(size):
+            counts[0] = counts[1] = counts[2] = counts[3] = 0
+            for i in range(x * scale, x * scale + scale):
+                for j in range(y * scale, y * scale + scale):
+                    counts[indexes[i][j]] += 1
+            best = 0
+            for i in range(1, 4):
+                if counts[i] >= counts[best]:
+                    best = i
+            if best == 0:
+                destination[x, y] = 0
+            else:
+                destination[x, y] = (
+                    COLORMAP[<unsigned char>colors[best - 1]] | <unsigned int>0xff000000
+                )
+
+# Palette index lookup, for the recording format
+
+cdef unsigned int[64] SORTED_COLORS
+cdef unsigned char[64] SORTED_INDEXES
+cdef unsigned int SORTED_COUNT = 0
+
+
+cdef void init_sorted_colors():
+    global SORTED_COUNT
+    cdef unsigned int color, i, j
+    cdef unsigned char index
+    for index in range(64):
+        color = COLORMAP[index] | <unsigned int>0xff000000
+        # Keep the first index for duplicated colors
+        i = 0
+        while i < SORTED_COUNT and SORTED_COLORS[i] < color:
+            i += 1
+        if i < SORTED_COUNT and SORTED_COLORS[i] == color:
+            continue
+        j = SORTED_COUNT
+        while j > i:
+            SORTED_COLORS[j] = SORTED_COLORS[j - 1]
+            SORTED_INDEXES[j] = SORTED_INDEXES[j - 1]
+            j -= 1
+        SORTED_COLORS[i] = color
+        SORTED_INDEXES[i] = index
+        SORTED_COUNT += 1
+
+
+init_sorted_colors()
+
+
+cdef inline unsigned char color_to_index(unsigned int color):
+    cdef unsigned int low = 0
+    cdef unsigned int high = SORTED_COUNT
+    cdef unsigned int middle
+    while low < high:
+        middle = (low + high) >> 1
+        if SORTED_COLORS[middle] < color:
+            low = middle + 1
+        else:
+            high = middle
+    if low < SORTED_COUNT and SORTED_COLORS[low] == color:
+        return SORTED_INDEXES[low]
+    # Not a NES color, use black
+    return 0x0f
+
+
+def to_palette_indexes(
+    np.ndarray[np.uint32_t, ndim=2] video,
+    np.ndarray[np.uint8_t, ndim=2] destination,
+):
+    cdef unsigned int height = video.shape[0]
+    cdef unsigned int width = video.shape[1]
+    cdef unsigned int i, j
+    cdef unsigned int color = 0
+    cdef unsigned char index = 0x0f
+    assert destination.shape[0] == height and destination.shape[1] == width
+    for i in range(height):
+        for j in range(width):
+            # Most pixels have the same color as their left neighbor
+            if video[i, j] != color:
+                color = video[i, j]
+                index = color_to_index(color)
+            destination[i, j] = index
+
+
+def encode_frame_delta(
+    np.ndarray[np.uint32_t, ndim=2, mode="c"] video,
+    np.ndarray[np.uint32_t, ndim=2, mode="c"] previous,
+    np.ndarray[np.uint8_t, ndim=1] output,
+):
+    # The encoded frame starts with a bitmap of the changed rows, followed for
+    # each changed row by its number of spans and the spans themselves (start,
+    # length minus one, palette indexes). `previous` is updated to match `video`
+    # and the size of the encoded data is returned.
+    cdef unsigned int height = video.shape[0]
+    cdef unsigned int width = video.shape[1]
+    cdef unsigned int bitmap_size = (height + 7) >> 3
+    cdef unsigned int size = bitmap_size
+    cdef unsigned int i, j, k, start, count_position, count
+    cdef unsigned int* row
+    cdef unsigned int* previous_row
+    assert previous.shape[0] == height and previous.shape[1] == width
+    assert width <= 256
+    assert <unsigned int>output.shape[0] >= max_delta_size(height, width)
+
+    for i in range(bitmap_size):
+        output[i] = 0
+
+    for i in range(height):
+        row = &video[i, 0]
+        previous_row = &previous[i, 0]
+        if memcmp(row, previous_row, width * sizeof(unsigned int)) == 0:
+            continue
+        output[i >> 3] |= 1 << (i & 7)
+        count_position = size
+        count = 0
+        size += 1
+        j = 0
+        while j < width:
+            if row[j] == previous_row[j]:
+                j += 1
+                continue
+            # Extend the span, absorbing gaps that are cheaper than a new span
+            start = j
+            j += 1
+            while j < width:
+                if row[j] != previous_row[j]:
+                    j += 1
+                elif j + 1 < width and row[j + 1] != previous_row[j + 1]:
+                    j += 2
+                elif j + 2 < width and row[j + 2] != previous_row[j + 2]:
+                    j += 3
+                else:
+                    break
+            output[size] = start
+            output[size + 1] = j - start - 1
+            size += 2
+            for k in range(start, j):
+                output[size] = color_to_index(row[k])
+                previous_row[k] = row[k]
+                size += 1
+            count += 1
+        output[count_position] = count
+    return size
+
+
+def decode_frame_delta(
+    const unsigned char[:] data,
+    np.ndarray[np.uint8_t, ndim=2] destination,
+):
+    cdef unsigned int height = destination.shape[0]
+    cdef unsigned int width = destination.shape[1]
+    cdef unsigned int bitmap_size = (height + 7) >> 3
+    cdef unsigned int position = bitmap_size
+    cdef unsigned int size = data.shape[0]
+    cdef unsigned int i, j, start, length, count, span
+    if size < bitmap_size:
+        raise ValueError("Truncated frame delta")
+    for i in range(height):
+        if not data[i >> 3] & (1 << (i & 7)):
+            continue
+        if position >= size:
+            raise ValueError("Truncated frame delta")
+        count = data[position]
+        position += 1
+        for span in range(count):
+            if position + 2 > size:
+                raise ValueError("Truncated frame delta")
+            start = data[position]
+            length = data[position + 1] + 1
+            position += 2
+            if start + length > width or position + length > size:
+                raise ValueError("Invalid frame delta")
+            for j in range(length):
+                destination[i, start + j] = data[position + j]
+            position += length
+
+
+cpdef unsigned int max_delta_size(unsigned int height, unsigned int width):
+    # Bitmap, then for each row a span count and at most one span every 4 pixels
+    return ((height + 7) >> 3) + height * (1 + 2 * ((width + 3) >> 2) + width)
+
+# PPU memory bus
+
+# Cartridge mirroring flags, in the order of the translation tables
+MIRRORING_MODES = ("H", "V")
+
+# Nametable RAM offset for each address of the 0x2000-0x2FFF range
+cdef unsigned short[2][4096] NAMETABLE_OFFSETS
+# The background color entries are shared by the background and sprite palettes
+cdef unsigned char[32] PALETTE_MIRRORS
+
+# Background tiles are indexed as `(y_index << 6) | x_index`
+cdef enum:
+    TILE_COUNT = 64 * 64
+NO_PALETTE = 0xFF
+
+
+cdef void init_bus_tables():
+    cdef unsigned int addr, table
+    for addr in range(4096):
+        table = addr >> 10
+        # Second physical table for 0x2C00, and either 0x2400 or 0x2800
+        NAMETABLE_OFFSETS[0][addr] = (addr & 0x3FF) | (0x400 if table in (2, 3) else 0)
+        NAMETABLE_OFFSETS[1][addr] = (addr & 0x3FF) | (0x400 if table in (1, 3) else 0)
+    for addr in range(32):
+        PALETTE_MIRRORS[addr] = addr ^ 0x10 if addr & 0x03 == 0 else addr
+
+
+init_bus_tables()
+
+
+cdef inline void mark_nametable(unsigned char* dirty, unsigned int offset):
+    # Mark the tiles using a nametable RAM byte
+    cdef unsigned int x = ((offset >> 10) & 0x01) << 5
+    cdef unsigned int y, dy, dx
+    offset &= 0x3FF
+    if offset < 0x03C0:
+        dirty[((offset >> 5) & 0x1F) << 6 | x | (offset & 0x1F)] = 1
+        return
+    # Attribute byte, for a block of 4x4 tiles
+    y = (offset & 0b00111000) >> 1
+    x |= (offset & 0b00000111) << 2
+    for dy in range(4):
+        for dx in range(4):
+            dirty[(y | dy) << 6 | x | dx] = 1
+
+
+cdef inline void mark_palette(
+    const unsigned char* tile_palettes, unsigned char* dirty, unsigned char palette
+):
+    cdef int index
+    for index in range(TILE_COUNT):
+        if tile_palettes[index] == palette:
+            dirty[index] = 1
+
+
+cdef int store_vram_byte(
+    object ppu,
+    unsigned char* ram,
+    unsigned char* palette,
+    unsigned char* dirty,
+    const unsigned short* nametable,
+    unsigned int addr,
+    unsigned char value,
+) except -1:
+    cdef unsigned int mirror
+    cdef bytearray tile_palettes
+    # Ram access
+    if 0x2000 <= addr < 0x3000:
+        addr = nametable[addr & 0xFFF]
+        if ram[addr] != value:
+            ram[addr] = value
+            mark_nametable(dirty, addr)
+        return 0
+    # Palette access
+    if 0x3F00 <= addr < 0x3F20:
+        addr &= 0x1F
+        mirror = PALETTE_MIRRORS[addr]
+        if mirror == addr and addr < 0x10 and palette[addr] != value:
+            tile_palettes = ppu.background_tile_palettes
+            mark_palette(tile_palettes, dirty, addr >> 2)
+        palette[addr] = value
+        palette[mirror] = value
+        return 0
+    # Invalid address, reported by the caller
+    return 1
+
+
+cdef int write_vram_byte(
+    object ppu,
+    unsigned char* ram,
+    unsigned char* palette,
+    unsigned char* dirty,
+    const unsigned short* nametable,
+    unsigned int addr,
+    unsigned char value,
+) except -1:
+    if store_vram_byte(ppu, ram, palette, dirty, nametable, addr, value):
+        raise ValueError(f"Invalid PPU write: 0x{addr:04x}")
+    return 0
+
+
+def write_vram(ppu, const unsigned char[:] data):
+    # Consecutive PPUDATA writes, starting at the current PPU address
+    cdef bytearray ram = ppu.ram
+    cdef bytearray palette = ppu.palette
+    cdef bytearray dirty = ppu.background_tile_dirty
+    cdef unsigned char mode = ppu.mirroring_mode
+    cdef unsigned int addr = ppu.ppu_addr
+    cdef unsigned int increment = 32 if ppu.ctrl & 0x04 else 1
+    cdef Py_ssize_t index
+    try:
+        for index in range(data.shape[0]):
+            write_vram_byte(
+                ppu, ram, palette, dirty, NAMETABLE_OFFSETS[mode], addr, data[index]
+            )
+            addr += increment
+    finally:
+        ppu.ppu_addr = addr
+
+
+def write_data(ppu, unsigned char value):
+    # Single PPUDATA write
+    if not try_write_data(ppu, value):
+        raise ValueError(f"Invalid PPU write: 0x{ppu.ppu_addr:04x}")
+
+
+def try_write_data(ppu, unsigned char value):
+    # Single PPUDATA write, called directly by the CPU core. Nothing is written
+    # for an invalid address, the core then goes through `write_data` with its
+    # registers in sync so that the error is reported from the right state.
+    cdef bytearray ram = ppu.ram
+    cdef bytearray palette = ppu.palette
+    cdef bytearray dirty = ppu.background_tile_dirty
+    cdef unsigned char mode = ppu.mirroring_mode
+    cdef unsigned int addr = ppu.ppu_addr
+    if store_vram_byte(ppu, ram, palette, dirty, NAMETABLE_OFFSETS[mode], addr, value):
+        return False
+    ppu.ppu_addr = addr + (32 if ppu.ctrl & 0x04 else 1)
+    return True
+
+
+def mark_ram_changes(const unsigned char[:] ram, const unsigned char[:] other, bytearray dirty):
+    # Mark the tiles whose nametable bytes differ between two RAM contents
+    cdef unsigned int offset
+    cdef unsigned char* dirty_pointer = dirty
+    assert ram.shape[0] == other.shape[0] == 0x800
+    for offset in range(0x800):
+        if ram[offset] != other[offset]:
+            mark_nametable(dirty_pointer, offset)
+
+
+def mark_palette_tiles(bytearray tile_palettes, bytearray dirty, unsigned char palette):
+    mark_palette(tile_palettes, dirty, palette)
@@ -0,0 +1,292 @@
+from __future__ import annotations
+
+import random
+import traceback
+import multiprocessing
+from argparse import Namespace
+from collections.abc import Callable
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any
+
+import numpy as np
+import numpy.typing as npt
+
+from .run import Cpu, Nes, SessionTemplate
+
+Observation = npt.NDArray[np.uint8]
+RewardFunction = Callable[[Nes], float]
+DoneFunction = Callable[[Nes], bool]
+
+# Controller bits, an action is any combination of those
+BUTTON_A = 0x01
+BUTTON_B = 0x02
+BUTTON_SELECT = 0x04
+BUTTON_START = 0x08
+BUTTON_UP = 0x10
+BUTTON_DOWN = 0x20
+BUTTON_LEFT = 0x40
+BUTTON_RIGHT = 0x80
+
+OBSERVATION_SHAPES = {
+    "ram": (8 * 256,),
+    "grayscale": (Nes.HEIGHT // 2, Nes.WIDTH // 2),
+}
+
+
+def no_reward(nes: Nes) -> float:
+    return 0.0
+
+
+def never_done(nes: Nes) -> bool:
+    return False
+
+
+class NesEnv:
+    # Gym-compatible environment (reset and step follow the gymnasium API)
+    # running a single console in the current process.
+
+    ACTION_COUNT = 256
+
+    def __init__(
+        self,
+        romfile: str,
+        frame_skip: int = 4,
+        observation: str = "ram",
+        reward_fn: RewardFunction = no_reward,
+        done_fn: DoneFunction = never_done,
+        max_episode_steps: int | None = None,
+        noop_max: int = 0,
+        out: Observation | None = None,
+    ) -> None:
+        if observation not in OBSERVATION_SHAPES:
+            raise ValueError(f"Invalid observation type: {observation!r}")
+        if frame_skip < 1:
+            raise ValueError("Frame skip must be at least 1")
+        self.nes = Nes(Namespace(romfile=romfile))
+        self.initial_state: Cpu = self.nes.snapshot()
+        self.frame_skip = frame_skip
+        self.observation = observation
+        self.observation_shape = OBSERVATION_SHAPES[observation]
+        self.reward_fn = reward_fn
+        self.done_fn = done_fn
+        self.max_episode_steps = max_episode_steps
+        self.noop_max = noop_max
+        self.rng = random.Random()
+        self.steps = 0
+        # Observations are written in place, possibly in shared memory
+        if out is None:
+            out = np.zeros(self.observation_shape, np.uint8)
+        assert out.shape == self.observation_shape and out.dtype == np.uint8
+        self.out = out
+        self.video = np.zeros((Nes.HEIGHT, Nes.WIDTH), np.uint32)
+
+    def reset(
+        self, seed: int | None = None, options: dict[str, Any] | None = None
+    ) -> tuple[Observation, dict[str, Any]]:
+        if seed is not None:
+            self.rng.seed(seed)
+        self.nes.restore(self.initial_state)
+        self.steps = 0
+        # The emulator is deterministic, random no-ops diversify the starts
+        noops = self.rng.randint(0, self.noop_max) if self.noop_max else 0
+        for _ in range(noops):
+            self.run_frame(0, render=False)
+        self.run_frame(0, render=self.observation == "grayscale")
+        self.observe()
+        return self.out, self.info()
+
+    def step(
+        self, action: int
+    ) -> tuple[Observation, float, bool, bool, dict[str, Any]]:
+        render = self.observation == "grayscale"
+        for i in range(self.frame_skip):
+            self.run_frame(action, render=render and i == self.frame_skip - 1)
+        self.steps += 1
+        self.observe()
+        reward = self.reward_fn(self.nes)
+        terminated = self.done_fn(self.nes)
+        truncated = (
+            self.max_episode_steps is not None and self.steps >= self.max_episode_steps
+        )
+        return self.out, reward, terminated, truncated, self.info()
+
+    def close(self) -> None:
+        pass
+
+    def run_frame(self, action: int, render: bool) -> None:
+        self.nes.cpu.input_value = action & 0xFF
+        if render:
+            self.nes.emulate_frame(self.video)
+        else:
+            # Keep the background tiles up to date only if they are needed later
+            self.nes.emulate_frame(update_tiles=self.observation == "grayscale")
+        self.nes.update_watch_lists()
+
+    def observe(self) -> None:
+        if self.observation == "ram":
+            self.out[:] = np.frombuffer(self.nes.cpu.ram, np.uint8)
+            return
+        # ARGB to luma on a 2x2 subsampled grid
+        pixels = self.video[::2, ::2]
+        red = (pixels >> 16) & 0xFF
+        green = (pixels >> 8) & 0xFF
+        blue = pixels & 0xFF
+        self.out[:] = (red * 77 + green * 150 + blue * 29) >> 8
+
+    def info(self) -> dict[str, Any]:
+        return {"frame": self.nes.cpu.frame, "steps": self.steps}
+
+
+class VectorNesEnv:
+    # Run `count` environments in subprocesses, stepping them in lockstep.
+    # Observations are written by the workers into a shared memory buffer,
+    # and finished episodes are reset automatically.
+
+    def __init__(self, count: int, romfile: str, **kwargs: Any) -> None:
+        observation = kwargs.get("observation", "ram")
+        if observation not in OBSERVATION_SHAPES:
+            raise ValueError(f"Invalid observation type: {observation!r}")
+        self.count = count
+        self.observation_shape = OBSERVATION_SHAPES[observation]
+        # Build the template first so forked workers inherit it, and so that
+        # an invalid ROM fails before anything is allocated
+        SessionTemplate.get(romfile)
+        size = count * int(np.prod(self.observation_shape))
+        self.shared_memory = SharedMemory(create=True, size=size)
+        self.observations: Observation = np.ndarray(
+            (count, *self.observation_shape), np.uint8, self.shared_memory.buf
+        )
+        self.connections: list[Connection] = []
+        self.processes: list[multiprocessing.process.BaseProcess] = []
+        self.closed = False
+        try:
+            self.start_workers(romfile, kwargs)
+        except BaseException:
+            # Stop the workers started so far and release the shared memory
+            self.close()
+            raise
+
+    def start_workers(self, romfile: str, kwargs: dict[str, Any]) -> None:
+        context = multiprocessing.get_context()
+        for index in range(self.count):
+            parent, child = context.Pipe()
+            process = context.Process(
+                target=worker,
+                args=(
+                    child,
+                    self.shared_memory.name,
+                    self.count,
+                    index,
+                    romfile,
+                    kwargs,
+                ),
+                daemon=True,
+            )
+            self.connections.append(parent)
+            try:
+                process.start()
+            finally:
+                child.close()
+            self.processes.append(process)
+
+    def reset(
+        self, seed: int | None = None, options: dict[str, Any] | None = None
+    ) -> tuple[Observation, list[dict[str, Any]]]:
+        for index, connection in enumerate(self.connections):
+            connection.send(("reset", None if seed is None else seed + index))
+        infos = [self.receive(connection) for connection in self.connections]
+        return self.observations, infos
+
+    def step(self, actions: npt.ArrayLike) -> tuple[
+        Observation,
+        npt.NDArray[np.float64],
+        npt.NDArray[np.bool_],
+        npt.NDArray[np.bool_],
+        list[dict[str, Any]],
+    ]:
+        for connection, action in zip(self.connections, np.asarray(actions)):
+            connection.send(("step", int(action)))
+        results = [self.receive(connection) for connection in self.connections]
+        rewards = np.array([result[0] for result in results], np.float64)
+        terminated = np.array([result[1] for result in results], np.bool_)
+        truncated = np.array([result[2] for result in results], np.bool_)
+        infos = [result[3] for result in results]
+        return self.observations, rewards, terminated, truncated, infos
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        for connection in self.connections:
+            try:
+                connection.send(("close", None))
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        for connection in self.connections:
+            connection.close()
+        # Drop our view before releasing the buffer
+        del self.observations
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+
+    def receive(self, connection: Connection) -> Any:
+        status, payload = connection.recv()
+        if status == "error":
+            raise RuntimeError(f"Environment worker failed:\n{payload}")
+        return payload
+
+    def __enter__(self) -> VectorNesEnv:
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+def worker(
+    connection: Connection,
+    shared_memory_name: str,
+    count: int,
+    index: int,
+    romfile: str,
+    kwargs: dict[str, Any],
+) -> None:
+    shared_memory = SharedMemory(name=shared_memory_name)
+    try:
+        shape = OBSERVATION_SHAPES[kwargs.get("observation", "ram")]
+        observations: Observation = np.ndarray(
+            (count, *shape), np.uint8, shared_memory.buf
+        )
+        try:
+            env = NesEnv(romfile, out=observations[index], **kwargs)
+        except Exception:
+            connection.send(("error", traceback.format_exc()))
+            return
+        while True:
+            command, argument = connection.recv()
+            try:
+                if command == "reset":
+                    _, info = env.reset(seed=argument)
+                    connection.send(("ok", info))
+                elif command == "step":
+                    _, reward, terminated, truncated, info = env.step(argument)
+                    if terminated or truncated:
+                        info["final_observation"] = env.out.copy()
+                        env.reset()
+                    connection.send(("ok", (reward, terminated, truncated, info)))
+                elif command == "close":
+                    break
+                else:
+                    raise ValueError(f"Invalid command: {command!r}")
+            except Exception:
+                connection.send(("error", traceback.format_exc()))
+        del env, observations
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        shared_memory.close()
+        connection.close()
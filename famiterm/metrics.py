@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import os
+import socket
+import threading
+import weakref
+from argparse import ArgumentParser, Namespace, _ActionsContainer
+from bisect import bisect_left
+from dataclasses import dataclass, field
+
+# Bucket upper bounds, the last implicit bucket being +Inf
+FRAME_TIME_BUCKETS = (0.001, 0.002, 0.004, 0.008, 0.016, 0.033, 0.066, 0.133)
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+COUNT_BUCKETS = (0, 1, 4, 16, 64, 256, 1024, 4096)
+
+
+@dataclass
+class Histogram:
+    buckets: tuple[float, ...]
+    counts: list[int] = field(init=False)
+    total: float = 0.0
+    count: int = 0
+
+    def __post_init__(self) -> None:
+        self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def merge(self, other: Histogram) -> None:
+        assert self.buckets == other.buckets
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.total += other.total
+        self.count += other.count
+
+    def copy(self) -> Histogram:
+        result = Histogram(self.buckets)
+        result.merge(self)
+        return result
+
+    def as_dict(self) -> dict[str, object]:
+        bounds = [*self.buckets, float("inf")]
+        return {
+            "buckets": dict(zip(bounds, self.counts)),
+            "sum": self.total,
+            "count": self.count,
+        }
+
+
+@dataclass(eq=False)
+class Metrics:
+    counters: dict[str, int] = field(default_factory=dict)
+    histograms: dict[str, Histogram] = field(default_factory=dict)
+
+    def add_counter(self, name: str) -> None:
+        self.counters.setdefault(name, 0)
+
+    def add_histogram(self, name: str, buckets: tuple[float, ...]) -> None:
+        self.histograms.setdefault(name, Histogram(buckets))
+
+    def increment(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def observe(self, name: str, value: float) -> None:
+        self.histograms[name].observe(value)
+
+    def merge(self, other: Metrics) -> None:
+        for name, value in list(other.counters.items()):
+            self.counters[name] = self.counters.get(name, 0) + value
+        for name, histogram in list(other.histograms.items()):
+            if name in self.histograms:
+                self.histograms[name].merge(histogram)
+            else:
+                self.histograms[name] = histogram.copy()
+
+    def as_dict(self) -> dict[str, object]:
+        result: dict[str, object] = dict(self.counters)
+        for name, histogram in self.histograms.items():
+            result[name] = histogram.as_dict()
+        return result
+
+    def to_prometheus(self, prefix: str = "famiterm") -> str:
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            metric = f"{prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, histogram in sorted(self.histograms.items()):
+            metric = f"{prefix}_{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            bounds = [*map(repr, histogram.buckets), "+Inf"]
+            for bound, count in zip(bounds, histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"{metric}_sum {histogram.total}")
+            lines.append(f"{metric}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsRegistry:
+    # Aggregates the metrics of all the sessions running in this process.
+    # Metrics of finished sessions are folded into `retired` so the exported
+    # counters never go backwards.
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.live: set[Metrics] = set()
+        self.retired = Metrics()
+
+    def register(self, owner: object, metrics: Metrics) -> None:
+        with self.lock:
+            self.live.add(metrics)
+        weakref.finalize(owner, self.retire, metrics)
+
+    def retire(self, metrics: Metrics) -> None:
+        with self.lock:
+            self.live.discard(metrics)
+            self.retired.merge(metrics)
+
+    def collect(self) -> tuple[Metrics, int]:
+        with self.lock:
+            live = list(self.live)
+            result = Metrics()
+            result.merge(self.retired)
+        for metrics in live:
+            result.merge(metrics)
+        return result, len(live)
+
+    def to_prometheus(self, prefix: str = "famiterm") -> str:
+        metrics, sessions = self.collect()
+        text = metrics.to_prometheus(prefix)
+        return text + f"# TYPE {prefix}_sessions gauge\n{prefix}_sessions {sessions}\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class MetricsExporter(threading.Thread):
+    def __init__(
+        self,
+        registry: MetricsRegistry,
+        path: str,
+        interval: float,
+        unix_socket: bool = False,
+    ) -> None:
+        super().__init__(name="famiterm-metrics", daemon=True)
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.unix_socket = unix_socket
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def export(self) -> None:
+        data = self.registry.to_prometheus().encode()
+        try:
+            if self.unix_socket:
+                self.send(data)
+            else:
+                self.write(data)
+        except OSError:
+            # The collector might not be there yet, try again next time
+            pass
+
+    def write(self, data: bytes) -> None:
+        # Atomic replace so readers never see a partial file
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def send(self, data: bytes) -> None:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.interval)
+            sock.connect(self.path)
+            sock.sendall(data)
+
+
+def add_metrics_arguments(parser: _ActionsContainer) -> None:
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--metrics-file",
+        type=str,
+        default=None,
+        help="Periodically write metrics to this file in Prometheus text format",
+    )
+    group.add_argument(
+        "--metrics-socket",
+        type=str,
+        default=None,
+        help="Periodically send metrics to this Unix socket in Prometheus text format",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=10.0,
+        help="Interval in seconds between two metrics exports (default: 10)",
+    )
+
+
+def start_metrics_export(
+    namespace: Namespace, registry: MetricsRegistry = REGISTRY
+) -> MetricsExporter | None:
+    if namespace.metrics_file is not None:
+        exporter = MetricsExporter(
+            registry, namespace.metrics_file, namespace.metrics_interval
+        )
+    elif namespace.metrics_socket is not None:
+        exporter = MetricsExporter(
+            registry,
+            namespace.metrics_socket,
+            namespace.metrics_interval,
+            unix_socket=True,
+        )
+    else:
+        return None
+    exporter.start()
+    return exporter
+
+
+def split_metrics_arguments(
+    parser_args: tuple[str, ...] | None,
+) -> tuple[Namespace, tuple[str, ...]]:
+    # Metrics are configured per process and not per console, so that
+    # ssh clients cannot pick the exported path through their command
+    parser = ArgumentParser(add_help=False)
+    add_metrics_arguments(parser)
+    namespace, remaining = parser.parse_known_args(parser_args)
+    return namespace, tuple(remaining)
@@ -1,3 +1,22 @@
+import numpy as np
+import numpy.typing as npt
+
 from .run import Cpu
 
-def run(cpu: Cpu) -> int: ...
+TRACE_DTYPE: np.dtype[np.void]
+
+class BlockCache:
+    def __init__(self, rom: bytes) -> None: ...
+    def __len__(self) -> int: ...
+    def invalidate(self) -> None: ...
+
+class Trace:
+    records: npt.NDArray[np.void]
+    capacity: int
+    count: int
+    def __init__(self, capacity: int = 65536) -> None: ...
+    def __len__(self) -> int: ...
+    def clear(self) -> None: ...
+    def latest(self, count: int | None = None) -> npt.NDArray[np.void]: ...
+
+def run(cpu: Cpu, cycle_limit: int = ...) -> int: ...
@@ -13,3 +13,35 @@ def render_tile(
     colors: bytes,
     destination: npt.NDArray[np.uint32],
 ) -> None: ...
+def render_scaled_tile(
+    rom: bytes,
+    address: int,
+    colors: bytes,
+    destination: npt.NDArray[np.uint32],
+    scale: int,
+) -> None: ...
+def to_palette_indexes(
+    video: npt.NDArray[np.uint32],
+    destination: npt.NDArray[np.uint8],
+) -> None: ...
+def encode_frame_delta(
+    video: npt.NDArray[np.uint32],
+    previous: npt.NDArray[np.uint32],
+    output: npt.NDArray[np.uint8],
+) -> int: ...
+def decode_frame_delta(
+    data: bytes | bytearray | memoryview,
+    destination: npt.NDArray[np.uint8],
+) -> None: ...
+def max_delta_size(height: int, width: int) -> int: ...
+
+MIRRORING_MODES: tuple[str, ...]
+NO_PALETTE: int
+
+def write_vram(ppu: object, data: bytes | bytearray | memoryview) -> None: ...
+def write_data(ppu: object, value: int) -> None: ...
+def try_write_data(ppu: object, value: int) -> bool: ...
+def mark_ram_changes(ram: bytearray, other: bytearray, dirty: bytearray) -> None: ...
+def mark_palette_tiles(
+    tile_palettes: bytearray, dirty: bytearray, palette: int
+) -> None: ...
@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import os
+import struct
+import time
+import zlib
+import itertools
+from argparse import ArgumentParser, Namespace, _ActionsContainer
+from bisect import bisect_right
+from collections.abc import Iterator
+from pathlib import Path
+from typing import BinaryIO
+
+import numpy as np
+import numpy.typing as npt
+
+from . import nesppu
+
+# File layout:
+# - header: magic, frame geometry, audio ticks per frame, FPS, keyframe interval
+# - colormap: 64 ARGB colors, so recordings can be played without the emulator
+# - records: a record header (kind, frame, video size, audio size) then the data
+# - index (optional, written on close): the keyframe offsets, then a trailer
+#
+# Video frames are palette indexes, either complete (keyframes) or encoded as
+# spans of changed pixels against the previous frame (deltas). Audio is
+# lossless, stored as sample deltas without the redundant channel and samples.
+# Both are compressed with zlib (fastest level).
+
+MAGIC = b"FAMIREC1"
+INDEX_MAGIC = b"FAMIIDX1"
+HEADER = struct.Struct("<8sHHIdI")
+COLORMAP = struct.Struct("<64I")
+RECORD = struct.Struct("<4sIII")
+INDEX_ENTRY = struct.Struct("<IQ")
+TRAILER = struct.Struct("<QII8s")
+
+KEYFRAME = b"KEYF"
+DELTA = b"DLTA"
+INDEX = b"INDX"
+
+DEFAULT_KEYFRAME_INTERVAL = 300
+
+
+AUDIO_MONO = 0x01
+AUDIO_DOUBLED = 0x02
+
+
+def encode_audio(audio: npt.NDArray[np.int16]) -> bytes:
+    # The mixer output is mono and generated at half the CPU rate,
+    # store each sample once when that's the case
+    flags = 0
+    samples = audio
+    if np.array_equal(samples[:, 0], samples[:, 1]):
+        flags |= AUDIO_MONO
+        samples = samples[:, :1]
+    if len(samples) % 2 == 0 and np.array_equal(samples[0::2], samples[1::2]):
+        flags |= AUDIO_DOUBLED
+        samples = samples[0::2]
+    deltas = np.diff(samples, axis=0, prepend=np.zeros_like(samples[:1]))
+    return bytes([flags]) + zlib.compress(deltas.tobytes(), 1)
+
+
+def decode_audio(data: bytes) -> npt.NDArray[np.int16]:
+    flags = data[0]
+    channels = 1 if flags & AUDIO_MONO else 2
+    deltas = np.frombuffer(zlib.decompress(data[1:]), np.int16)
+    # Wrapping int16 arithmetic restores the exact samples
+    samples = np.cumsum(deltas.reshape(-1, channels), axis=0, dtype=np.int16)
+    if flags & AUDIO_DOUBLED:
+        samples = np.repeat(samples, 2, axis=0)
+    if flags & AUDIO_MONO:
+        samples = np.repeat(samples, 2, axis=1)
+    return samples
+
+
+class Recorder:
+    def __init__(
+        self,
+        file: BinaryIO,
+        height: int,
+        width: int,
+        ticks_in_frame: int,
+        fps: float,
+        keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL,
+    ) -> None:
+        self.file = file
+        self.keyframe_interval = keyframe_interval
+        self.frame = 0
+        self.keyframes: list[tuple[int, int]] = []
+        self.previous = np.zeros((height, width), np.uint32)
+        self.indexes = np.zeros((height, width), np.uint8)
+        self.output = np.zeros(nesppu.max_delta_size(height, width), np.uint8)
+        colormap = [nesppu.get_color(index) for index in range(64)]
+        self.file.write(
+            HEADER.pack(MAGIC, height, width, ticks_in_frame, fps, keyframe_interval)
+        )
+        self.file.write(COLORMAP.pack(*colormap))
+        self.closed = False
+
+    @classmethod
+    def open(
+        cls,
+        path: str | os.PathLike[str],
+        height: int,
+        width: int,
+        ticks_in_frame: int,
+        fps: float,
+        keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL,
+    ) -> Recorder:
+        file = open(path, "wb")
+        return cls(file, height, width, ticks_in_frame, fps, keyframe_interval)
+
+    def write_frame(
+        self, video: npt.NDArray[np.uint32], audio: npt.NDArray[np.int16]
+    ) -> None:
+        if self.frame % self.keyframe_interval == 0:
+            kind = KEYFRAME
+            self.keyframes.append((self.frame, self.file.tell()))
+            nesppu.to_palette_indexes(video, self.indexes)
+            np.copyto(self.previous, video)
+            video_data = zlib.compress(self.indexes.tobytes(), 1)
+        else:
+            kind = DELTA
+            size = nesppu.encode_frame_delta(video, self.previous, self.output)
+            video_data = zlib.compress(self.output[:size].tobytes(), 1)
+        audio_data = encode_audio(audio)
+        self.file.write(RECORD.pack(kind, self.frame, len(video_data), len(audio_data)))
+        self.file.write(video_data)
+        self.file.write(audio_data)
+        self.frame += 1
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        offset = self.file.tell()
+        size = INDEX_ENTRY.size * len(self.keyframes)
+        self.file.write(RECORD.pack(INDEX, self.frame, size, 0))
+        for entry in self.keyframes:
+            self.file.write(INDEX_ENTRY.pack(*entry))
+        self.file.write(
+            TRAILER.pack(offset, len(self.keyframes), self.frame, INDEX_MAGIC)
+        )
+        self.file.close()
+
+
+class Player:
+    def __init__(self, file: BinaryIO) -> None:
+        self.file = file
+        header = self.file.read(HEADER.size)
+        magic, height, width, ticks, fps, interval = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError("Not a famiterm recording")
+        self.height = height
+        self.width = width
+        self.ticks_in_frame = ticks
+        self.fps = fps
+        self.keyframe_interval = interval
+        self.colormap = np.array(COLORMAP.unpack(self.file.read(COLORMAP.size)))
+        self.colormap = self.colormap.astype(np.uint32)
+        self.data_offset = self.file.tell()
+        self.keyframes, self.frame_count = self.read_index()
+        self.indexes = np.zeros((height, width), np.uint8)
+        self.frame = 0
+        self.seek(0)
+
+    @classmethod
+    def open(cls, path: str | os.PathLike[str]) -> Player:
+        return cls(open(path, "rb"))
+
+    def __len__(self) -> int:
+        return self.frame_count
+
+    def __iter__(
+        self,
+    ) -> Iterator[tuple[npt.NDArray[np.uint32], npt.NDArray[np.int16]]]:
+        while True:
+            result = self.read_frame()
+            if result is None:
+                return
+            yield result
+
+    def close(self) -> None:
+        self.file.close()
+
+    def read_index(self) -> tuple[list[tuple[int, int]], int]:
+        # Use the index written on close, or scan the records if the
+        # recording was interrupted
+        self.file.seek(0, os.SEEK_END)
+        end = self.file.tell()
+        if end - self.data_offset >= TRAILER.size:
+            self.file.seek(end - TRAILER.size)
+            offset, count, frames, magic = TRAILER.unpack(self.file.read(TRAILER.size))
+            if magic == INDEX_MAGIC:
+                self.file.seek(offset + RECORD.size)
+                entries = [
+                    INDEX_ENTRY.unpack(self.file.read(INDEX_ENTRY.size))
+                    for _ in range(count)
+                ]
+                return entries, frames
+        keyframes = []
+        frames = 0
+        offset = self.data_offset
+        while offset + RECORD.size <= end:
+            self.file.seek(offset)
+            kind, frame, video_size, audio_size = RECORD.unpack(
+                self.file.read(RECORD.size)
+            )
+            next_offset = offset + RECORD.size + video_size + audio_size
+            if kind not in (KEYFRAME, DELTA) or next_offset > end:
+                break
+            if kind == KEYFRAME:
+                keyframes.append((frame, offset))
+            frames = frame + 1
+            offset = next_offset
+        return keyframes, frames
+
+    def read_record(self) -> tuple[bytes, int, bytes, bytes] | None:
+        if self.frame >= self.frame_count:
+            return None
+        kind, frame, video_size, audio_size = RECORD.unpack(self.file.read(RECORD.size))
+        assert frame == self.frame
+        video_data = self.file.read(video_size)
+        audio_data = self.file.read(audio_size)
+        self.frame += 1
+        return kind, frame, video_data, audio_data
+
+    def apply(self, kind: bytes, video_data: bytes) -> None:
+        if kind == KEYFRAME:
+            self.indexes[:] = np.frombuffer(
+                zlib.decompress(video_data), np.uint8
+            ).reshape(self.height, self.width)
+        else:
+            nesppu.decode_frame_delta(zlib.decompress(video_data), self.indexes)
+
+    def seek(self, frame: int) -> None:
+        # Decode from the closest keyframe, the next read returns `frame`
+        if not 0 <= frame <= self.frame_count or not self.keyframes:
+            raise ValueError(f"Invalid frame: {frame}")
+        position = bisect_right(self.keyframes, (frame, float("inf"))) - 1
+        keyframe, offset = self.keyframes[max(position, 0)]
+        self.file.seek(offset)
+        self.frame = keyframe
+        while self.frame < frame:
+            record = self.read_record()
+            assert record is not None
+            self.apply(record[0], record[2])
+
+    def read_frame(
+        self,
+    ) -> tuple[npt.NDArray[np.uint32], npt.NDArray[np.int16]] | None:
+        record = self.read_record()
+        if record is None:
+            return None
+        kind, _, video_data, audio_data = record
+        self.apply(kind, video_data)
+        return self.colormap[self.indexes], decode_audio(audio_data)
+
+
+# Recording configuration, set per process like the metrics export
+
+recording_directory: Path | None = None
+recording_counter = itertools.count()
+
+
+def add_recording_arguments(parser: _ActionsContainer) -> None:
+    parser.add_argument(
+        "--record-directory",
+        type=Path,
+        default=None,
+        help="Record every session (video and audio) into this directory",
+    )
+
+
+def split_recording_arguments(
+    parser_args: tuple[str, ...] | None,
+) -> tuple[Namespace, tuple[str, ...]]:
+    parser = ArgumentParser(add_help=False)
+    add_recording_arguments(parser)
+    namespace, remaining = parser.parse_known_args(parser_args)
+    return namespace, tuple(remaining)
+
+
+def configure_recording(namespace: Namespace) -> None:
+    global recording_directory
+    recording_directory = namespace.record_directory
+    if recording_directory is not None:
+        recording_directory.mkdir(parents=True, exist_ok=True)
+
+
+def new_recording_path() -> Path | None:
+    if recording_directory is None:
+        return None
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    name = f"{timestamp}-{os.getpid()}-{next(recording_counter)}.famirec"
+    return recording_directory / name
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+from collections import deque
+
+import numpy as np
+import numpy.typing as npt
+
+from .run import Cpu, Nes
+
+
+class Rollback:
+    # Rollback netcode for two players on a single console. Remote inputs are
+    # predicted by repeating the last known value. When a late input does not
+    # match the prediction, the state saved at the start of that frame is
+    # restored and the following frames are re-simulated headlessly.
+
+    def __init__(self, nes: Nes, local_player: int = 0, max_rollback: int = 8):
+        assert local_player in (0, 1)
+        self.nes = nes
+        self.local_player = local_player
+        self.max_rollback = max_rollback
+
+        # Next frame to run
+        self.frame = 0
+        # States at the start of the frames that can still be rolled back
+        self.states: dict[int, Cpu] = {}
+        # Inputs used for the frames that can still be rolled back
+        self.inputs: dict[int, tuple[int, int]] = {}
+
+        self.local_inputs: dict[int, int] = {}
+        self.last_local_input = 0
+        self.remote_inputs: dict[int, int] = {}
+        # Latest remote input among the frames that are no longer tracked
+        self.base_remote_input = 0
+        self.rollback_frame: int | None = None
+        # The APU keeps running when no audio is requested, its output is discarded
+        self.scratch_audio = np.zeros((nes.TICKS_IN_FRAME, 2), np.int16)
+
+        # Statistics
+        self.rollbacks = 0
+        self.resimulated_frames = 0
+
+    @property
+    def oldest_frame(self) -> int:
+        return max(0, self.frame - self.max_rollback)
+
+    def set_local_input(self, value: int) -> int:
+        # Set the local input for the next frame and return its frame number
+        self.local_inputs[self.frame] = value & 0xFF
+        return self.frame
+
+    def add_remote_input(self, frame: int, value: int) -> None:
+        if frame < self.oldest_frame:
+            raise ValueError(f"Remote input for frame {frame} is too late")
+        self.remote_inputs[frame] = value & 0xFF
+        # Check the inputs used for the frames that have already been run
+        for past_frame in range(frame, self.frame):
+            if self.frame_inputs(past_frame) != self.inputs[past_frame]:
+                if self.rollback_frame is None or past_frame < self.rollback_frame:
+                    self.rollback_frame = past_frame
+                break
+
+    def predict_remote_input(self, frame: int) -> int:
+        # Use the confirmed input, or repeat the latest one known before that frame
+        for past_frame in range(frame, self.oldest_frame - 1, -1):
+            value = self.remote_inputs.get(past_frame)
+            if value is not None:
+                return value
+        return self.base_remote_input
+
+    def frame_inputs(self, frame: int) -> tuple[int, int]:
+        local = self.local_inputs[frame]
+        remote = self.predict_remote_input(frame)
+        if self.local_player == 0:
+            return local, remote
+        return remote, local
+
+    def advance(
+        self,
+        video: npt.NDArray[np.uint32] | None = None,
+        audio: npt.NDArray[np.int16] | None = None,
+    ) -> None:
+        if self.rollback_frame is not None:
+            self.resimulate(self.rollback_frame)
+            self.rollback_frame = None
+        # Repeat the previous local input if none was provided
+        local_input = self.local_inputs.setdefault(self.frame, self.last_local_input)
+        self.last_local_input = local_input
+        self.run_frame(self.frame, video, audio)
+        # Re-simulated frames have already been reported to the watchers
+        self.nes.update_watch_lists()
+        self.frame += 1
+        self.prune()
+
+    def resimulate(self, start: int) -> None:
+        self.rollbacks += 1
+        self.nes.quick_load(self.states[start])
+        # Rendering and audio output are disabled, tile changes are accumulated
+        # and drawn once by the next rendered frame
+        for frame in range(start, self.frame):
+            self.run_frame(frame, None, None)
+            self.resimulated_frames += 1
+
+    def run_frame(
+        self,
+        frame: int,
+        video: npt.NDArray[np.uint32] | None,
+        audio: npt.NDArray[np.int16] | None,
+    ) -> None:
+        self.states[frame] = self.nes.quick_save()
+        inputs = self.inputs[frame] = self.frame_inputs(frame)
+        self.nes.set_controllers(*inputs)
+        if audio is None:
+            audio = self.scratch_audio
+        self.nes.emulate_frame(video, audio, update_tiles=False)
+
+    def prune(self) -> None:
+        oldest = self.oldest_frame
+        for mapping in (self.states, self.inputs, self.local_inputs):
+            for frame in [frame for frame in mapping if frame < oldest]:
+                del mapping[frame]
+        for frame in sorted(frame for frame in self.remote_inputs if frame < oldest):
+            self.base_remote_input = self.remote_inputs.pop(frame)
+
+
+class LoopbackPeer:
+    # Deliver inputs to a rollback engine after an artificial delay (in frames),
+    # to exercise rollbacks without a network
+
+    def __init__(self, target: Rollback, delay: int):
+        self.target = target
+        self.delay = delay
+        self.clock = 0
+        self.queue: deque[tuple[int, int, int]] = deque()
+
+    def send(self, frame: int, value: int) -> None:
+        self.queue.append((self.clock + self.delay, frame, value))
+
+    def tick(self) -> None:
+        self.clock += 1
+        while self.queue and self.queue[0][0] <= self.clock:
+            _, frame, value = self.queue.popleft()
+            self.target.add_remote_input(frame, value)
@@ -1,11 +1,16 @@
 from __future__ import annotations
-from argparse import ArgumentParser, Namespace
+from argparse import SUPPRESS, ArgumentParser, Namespace, RawDescriptionHelpFormatter
 
+import os
 import pickle
-from copy import deepcopy
+import threading
+import time
+import weakref
+from copy import copy, deepcopy
 from enum import IntEnum
-from functools import lru_cache
 from dataclasses import dataclass, field
+from typing import Any, ClassVar
+from collections.abc import Iterable
 import zlib
 
 
@@ -17,12 +22,46 @@ from gambaterm.main import main as gambaterm_main
 from . import nescpu
 from . import nesppu
 from . import nesapu
+from .recording import (
+    DEFAULT_KEYFRAME_INTERVAL,
+    Recorder,
+    add_recording_arguments,
+    configure_recording,
+    new_recording_path,
+    split_recording_arguments,
+)
+from .metrics import (
+    REGISTRY,
+    COUNT_BUCKETS,
+    DURATION_BUCKETS,
+    FRAME_TIME_BUCKETS,
+    Metrics,
+    add_metrics_arguments,
+    split_metrics_arguments,
+    start_metrics_export,
+)
+from .trace import format_records
 
 
 class InfiniteLoop(Exception):
     pass
 
 
+class CpuFault(ValueError):
+    # Replace the errors raised by the CPU core when tracing is enabled,
+    # so the last executed instructions end up in the report
+
+    TRACE_LENGTH = 32
+
+    def __init__(self, message: str, records: npt.NDArray[np.void]) -> None:
+        super().__init__(message)
+        self.records = records
+
+    def __str__(self) -> str:
+        trace = format_records(self.records)
+        return f"{self.args[0]}\nLast executed instructions:\n{trace}"
+
+
 @dataclass
 class Cartridge:
     mapper: int
@@ -33,6 +72,14 @@ class Cartridge:
     trainer: bytes | None
     prg_rom: bytes
     chr_rom: bytes
+    block_cache: nescpu.BlockCache = field(init=False, repr=False, compare=False)
+    tile_cache: dict[tuple[int, bytes, int], npt.NDArray[np.uint32]] = field(
+        init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        self.block_cache = nescpu.BlockCache(self.prg_rom)
+        self.tile_cache = {}
 
 
 class ApuRegister(IntEnum):
@@ -322,6 +369,14 @@ class Apu:
 
     TICKS_IN_FRAME = 14890
 
+    def copy_state(self) -> Apu:
+        state = copy(self)
+        state.pulse1 = copy(self.pulse1)
+        state.pulse2 = copy(self.pulse2)
+        state.triangle = copy(self.triangle)
+        state.noise = copy(self.noise)
+        return state
+
     def write_register(self, cpu: Cpu, register: int, value: int) -> None:
         register = ApuRegister(register)
         if register == register.FRAME_COUNTER:
@@ -442,14 +497,33 @@ class Ppu:
 
     # Changes
     background_pattern_table_address_changed: bool = False
-    background_tile_changed: set[tuple[int, int]] = field(default_factory=set)
+    # Tiles are indexed as `(y_index << 6) | x_index`
+    background_tile_dirty: bytearray = field(default_factory=lambda: bytearray(64 * 64))
     background_tiles: npt.NDArray[np.uint32] = field(
         default_factory=lambda: np.zeros((240 * 2, 256 * 2), dtype=np.uint32)
     )
-    background_tiles_with_palette: list[set[tuple[int, int]]] = field(
-        default_factory=lambda: [set(), set(), set(), set()]
+    # Palette used by each tile of the cache
+    background_tile_palettes: bytearray = field(
+        default_factory=lambda: bytearray([nesppu.NO_PALETTE]) * (64 * 64)
     )
 
+    background_tiles_stale: bool = False
+    # Background tiles are drawn at the output scale (1, 2 or 4)
+    background_scale: int = 1
+
+    # Statistics for the current frame
+    tiles_redrawn: int = 0
+    tile_lookups: int = 0
+    tile_misses: int = 0
+
+    # Index of the nametable translation table, from the cartridge mirroring
+    mirroring_mode: int = field(init=False)
+
+    STATUS_POLL_LIMIT = 8
+
+    def __post_init__(self) -> None:
+        self.mirroring_mode = nesppu.MIRRORING_MODES.index(self.cartridge.mirroring)
+
     # Properties from PPUCTRL
 
     @property
@@ -491,9 +565,12 @@ class Ppu:
         self.y_scroll_before_sprite_zero_hit = 0
         self.instruction_count_at_last_ppu_status_read = 0
 
-        self.background_tile_changed.clear()
+        # Tile changes are kept until the next `update_tiles`
         self.background_palette_changed = False
-        self.background_pattern_table_address_changed = False
+
+        self.tiles_redrawn = 0
+        self.tile_lookups = 0
+        self.tile_misses = 0
 
     def read_register(self, cpu: Cpu, reg: int) -> int:
         if reg == PpuRegister.PPUCTRL:
@@ -501,35 +578,7 @@ class Ppu:
         if reg == PpuRegister.PPUMASK:
             return self.mask
         if reg == PpuRegister.PPUSTATUS:
-            # Clear
-            self.ppu_addr = 0
-            self.scroll_toggle = 0
-            # Tight loop detected
-            if (
-                cpu.instruction_count
-                <= self.instruction_count_at_last_ppu_status_read + 3
-            ):
-                if not self.sprite_zero_hit:
-                    self.x_scroll_before_sprite_zero_hit = self.x_scroll | (
-                        (self.ctrl & 0x01) << 8
-                    )
-                    self.y_scroll_before_sprite_zero_hit = self.y_scroll | (
-                        (self.ctrl & 0x02) << 7
-                    )
-                    self.sprite_zero_hit = True
-                else:
-                    self.sprite_zero_hit = False
-                    self.vblank = True
-            self.instruction_count_at_last_ppu_status_read = cpu.instruction_count
-            # First read after VBlank
-            if self.vblank:
-                self.vblank = False
-                return 0x80
-            # Sprite 0 Hit has not been reached
-            if not self.sprite_zero_hit:
-                return 0x00
-            # Sprite 0 Hit has been reached
-            return 0x40
+            return self.read_status(cpu.instruction_count)
         if reg == PpuRegister.OAMADDR:
             raise NotImplementedError
         if reg == PpuRegister.OAMDATA:
@@ -544,6 +593,48 @@ class Ppu:
             return result
         assert False
 
+    def read_status(self, instruction_count: int) -> int:
+        # Clear
+        self.ppu_addr = 0
+        self.scroll_toggle = 0
+        # Tight loop detected
+        if instruction_count <= self.instruction_count_at_last_ppu_status_read + 3:
+            if not self.sprite_zero_hit:
+                self.x_scroll_before_sprite_zero_hit = self.x_scroll | (
+                    (self.ctrl & 0x01) << 8
+                )
+                self.y_scroll_before_sprite_zero_hit = self.y_scroll | (
+                    (self.ctrl & 0x02) << 7
+                )
+                self.sprite_zero_hit = True
+            else:
+                self.sprite_zero_hit = False
+                self.vblank = True
+        self.instruction_count_at_last_ppu_status_read = instruction_count
+        # First read after VBlank
+        if self.vblank:
+            self.vblank = False
+            return 0x80
+        # Sprite 0 Hit has not been reached
+        if not self.sprite_zero_hit:
+            return 0x00
+        # Sprite 0 Hit has been reached
+        return 0x40
+
+    def poll_status(
+        self, cpu: Cpu, mask: int, exit_when_set: bool, stride: int
+    ) -> tuple[int, int]:
+        # Called by the CPU core for a loop polling PPUSTATUS every `stride`
+        # instructions, until `bool(status & mask) == exit_when_set`.
+        # Return the last status value and the number of polls.
+        instruction_count = cpu.instruction_count
+        for polls in range(1, self.STATUS_POLL_LIMIT + 1):
+            value = self.read_status(instruction_count)
+            if bool(value & mask) == exit_when_set:
+                break
+            instruction_count += stride
+        return value, polls
+
     def write_register(self, cpu: "Cpu", reg: int, value: int) -> None:
         if reg == PpuRegister.PPUCTRL:
             old_address = self.background_pattern_table_address
@@ -578,8 +669,7 @@ class Ppu:
             self.ppu_addr_toggle ^= 1
             return
         if reg == PpuRegister.PPUDATA:
-            self.ppu_write(self.ppu_addr, value)
-            self.ppu_addr += self.ram_address_increment
+            nesppu.write_data(self, value)
             return
         assert False, reg
 
@@ -600,64 +690,89 @@ class Ppu:
             raise NotImplementedError
         raise ValueError(f"Invalid PPU read: 0x{addr:04x}")
 
-    def ppu_write(self, addr: int, value: int) -> None:
-        # Ram access
-        if 0x2000 <= addr < 0x3000:
-            a_addr = addr & 0x3FF
-            b_addr = (addr & 0x3FF) + 0x400
-            if 0x2000 <= addr < 0x2400:
-                addr = a_addr
-            elif 0x2400 <= addr < 0x2800:
-                addr = a_addr if self.cartridge.mirroring == "H" else b_addr
-            elif 0x2800 <= addr < 0x2C00:
-                addr = b_addr if self.cartridge.mirroring == "H" else a_addr
-            elif 0x2C00 <= addr < 0x3000:
-                addr = b_addr
-            else:
-                assert False
-            if self.ram[addr] != value:
-                self.background_tile_changed.update(self.addr_to_indexes(addr))
-            self.ram[addr] = value
-            return
-        # Palette access
-        if 0x3F00 <= addr < 0x3F20:
-            addr &= 0x1F
-            if addr in (0x00, 0x04, 0x08, 0x0C):
-                self.palette[addr | 0x10] = value
-            elif addr in (0x10, 0x14, 0x18, 0x1C):
-                self.palette[addr & ~0x10] = value
-            elif addr < 0x10 and self.palette[addr] != value:
-                self.background_tile_changed.update(
-                    self.background_tiles_with_palette[addr >> 2]
-                )
-            self.palette[addr] = value
-            return
-        raise ValueError(f"Invalid PPU write: 0x{addr:04x}")
+    def write_vram(self, data: bytes | bytearray | memoryview) -> None:
+        # Bulk upload, same as consecutive PPUDATA writes
+        nesppu.write_vram(self, data)
 
-    def render(self, video: npt.NDArray[np.uint32]) -> None:
+    def render(self, video: npt.NDArray[np.uint32], scale: int = 1) -> None:
+        # Render directly at 1/scale of the full resolution
         self.render_background_color(video)
-        self.render_sprite(video, behind=True)
-        self.render_background(video)
-        self.render_sprite(video, behind=False)
+        self.render_sprite(video, behind=True, scale=scale)
+        self.render_background(video, scale=scale)
+        self.render_sprite(video, behind=False, scale=scale)
 
     def render_background_color(self, video: npt.NDArray[np.uint32]) -> None:
         background_color = self.palette[0]
         video.fill(nesppu.get_color(background_color))
 
+    def set_background_scale(self, scale: int) -> None:
+        if scale == self.background_scale:
+            return
+        if scale not in (1, 2, 4):
+            raise ValueError(f"Invalid scale: {scale}")
+        self.background_scale = scale
+        self.background_tiles = np.zeros(
+            (240 * 2 // scale, 256 * 2 // scale), dtype=np.uint32
+        )
+        self.background_tiles_stale = True
+
     def update_tiles(self) -> None:
         base_pattern_address = self.background_pattern_table_address
         # Draw everything
         if (
             self.background_pattern_table_address_changed
             or self.background_palette_changed
+            or self.background_tiles_stale
         ):
             for x_index in range(64):
                 for y_index in range(30):
                     self.update_tile(y_index, x_index, base_pattern_address)
-            return
+            self.tiles_redrawn += 64 * 30
         # Draw changes
-        for y_index, x_index in self.background_tile_changed:
-            self.update_tile(y_index, x_index, base_pattern_address)
+        else:
+            dirty = np.frombuffer(self.background_tile_dirty, np.uint8)
+            indexes = np.flatnonzero(dirty).tolist()
+            self.tiles_redrawn += len(indexes)
+            for index in indexes:
+                self.update_tile(index >> 6, index & 0x3F, base_pattern_address)
+        self.background_tile_dirty[:] = bytes(64 * 64)
+        self.background_pattern_table_address_changed = False
+        self.background_tiles_stale = False
+
+    def copy_state(self) -> Ppu:
+        # Copy of the emulated state, sharing the background tile cache
+        state = copy(self)
+        state.ram = self.ram.copy()
+        state.oam = self.oam.copy()
+        state.palette = self.palette.copy()
+        state.background_tile_dirty = self.background_tile_dirty.copy()
+        return state
+
+    def adopt_tile_cache(self, other: Ppu) -> None:
+        # Take over the background tile cache of `other`, marking the tiles
+        # that were drawn from different VRAM or palette contents
+        self.background_tiles = other.background_tiles
+        self.background_tile_palettes = other.background_tile_palettes
+        self.background_scale = other.background_scale
+        # Our own pending changes were relative to an older cache content
+        self.background_tile_dirty = other.background_tile_dirty.copy()
+        self.background_pattern_table_address_changed = False
+        self.background_tiles_stale = False
+        if (
+            other.background_tiles_stale
+            or other.background_pattern_table_address_changed
+            or other.background_pattern_table_address
+            != self.background_pattern_table_address
+        ):
+            self.background_tiles_stale = True
+            return
+        for index in range(4):
+            colors = slice(index * 4 + 1, index * 4 + 4)
+            if self.palette[colors] != other.palette[colors]:
+                nesppu.mark_palette_tiles(
+                    self.background_tile_palettes, self.background_tile_dirty, index
+                )
+        nesppu.mark_ram_changes(self.ram, other.ram, self.background_tile_dirty)
 
     def index_to_addr(self, y: int, x: int) -> tuple[int, int]:
         nametable = ((y & 0x20) << 6) | ((x & 0x20) << 5)
@@ -667,18 +782,6 @@ class Ppu:
         palette |= (x & 0b00011100) >> 2
         return pattern, palette
 
-    def addr_to_indexes(self, addr: int) -> list[tuple[int, int]]:
-        y = ((addr >> 11) & 0x01) << 5
-        x = ((addr >> 10) & 0x01) << 5
-        addr &= 0x3FF
-        if addr < 0x03C0:
-            y |= (addr >> 5) & 0x1F
-            x |= (addr >> 0) & 0x1F
-            return [(y, x)]
-        y |= (addr & 0b00111000) >> 1
-        x |= (addr & 0b00000111) << 2
-        return [(y | dy, x | dx) for dy in range(4) for dx in range(4)]
-
     def update_tile(
         self, y_index: int, x_index: int, base_pattern_address: int
     ) -> None:
@@ -696,44 +799,46 @@ class Ppu:
         palette_address = ((palette_address >> shift) & 0x3) << 2
         colors = self.palette[palette_address + 1 : palette_address + 4]
         # Update palette info
-        palette_address >>= 2
-        entry = (y_index, x_index)
-        if entry not in self.background_tiles_with_palette[palette_address]:
-            for tile_set in self.background_tiles_with_palette:
-                tile_set.discard(entry)
-            self.background_tiles_with_palette[palette_address].add(entry)
+        self.background_tile_palettes[(y_index << 6) | x_index] = palette_address >> 2
         # Get tile
-        tile = self.render_tile(pattern_address, bytes(colors))
+        scale = self.background_scale
+        tile = self.render_tile(pattern_address, bytes(colors), scale)
         # Blit tile
         y_pixel = y_index << 3
         x_pixel = x_index << 3
         if y_index >= 32:
             y_pixel -= 16
-        self.background_tiles[y_pixel : y_pixel + 8, x_pixel : x_pixel + 8] = tile
+        y_pixel //= scale
+        x_pixel //= scale
+        size = 8 // scale
+        self.background_tiles[y_pixel : y_pixel + size, x_pixel : x_pixel + size] = tile
 
-    def render_background(self, video: npt.NDArray[np.uint32]) -> None:
+    def render_background(self, video: npt.NDArray[np.uint32], scale: int = 1) -> None:
+        self.set_background_scale(scale)
         self.update_tiles()
         if not self.show_background:
             return
         first_row = 8  # Hide first and last row like most monitors
         sprite_zero_hit_y = self.oam[0] + 8
         x_scroll = self.x_scroll | ((self.ctrl & 0x01) << 8)
+        # Scale the coordinates, rounding down like the tile positions
+        split = sprite_zero_hit_y // scale
+        top = -first_row // scale
+        bottom = (sprite_zero_hit_y - first_row) // scale
+        nesppu.blit(self.background_tiles[:split, :], video, (top, 0))
         nesppu.blit(
-            self.background_tiles[:sprite_zero_hit_y, :], video, (-first_row, 0)
-        )
-        nesppu.blit(
-            self.background_tiles[sprite_zero_hit_y:, :],
+            self.background_tiles[split:, :],
             video,
-            (sprite_zero_hit_y - first_row, 0 - x_scroll),
+            (bottom, -x_scroll // scale),
         )
         nesppu.blit(
-            self.background_tiles[sprite_zero_hit_y:, :],
+            self.background_tiles[split:, :],
             video,
-            (sprite_zero_hit_y - first_row, 512 - x_scroll),
+            (bottom, (512 - x_scroll) // scale),
         )
 
     def render_sprite(
-        self, video: npt.NDArray[np.uint32], behind: bool = False
+        self, video: npt.NDArray[np.uint32], behind: bool = False, scale: int = 1
     ) -> None:
         if not self.show_sprites:
             return
@@ -756,7 +861,7 @@ class Ppu:
             palette_addr = 0x10 | (color_index << 2)
             colors = palette[palette_addr + 1 : palette_addr + 4]
             # Tile
-            tile = self.render_tile(pattern_addr, bytes(colors))
+            tile = self.render_tile(pattern_addr, bytes(colors), scale)
             # Vertical flip
             if attr & 0x80:
                 tile = tile[::-1, :]
@@ -764,12 +869,26 @@ class Ppu:
             if attr & 0x40:
                 tile = tile[:, ::-1]
             # Blit
-            nesppu.blit(tile, video, (y - first_row, x))
-
-    @lru_cache(maxsize=None)
-    def render_tile(self, pattern_addr: int, colors: bytes) -> npt.NDArray[np.uint32]:
-        result = np.zeros((8, 8), dtype=np.uint32)
-        nesppu.render_tile(self.cartridge.chr_rom, pattern_addr, colors, result)
+            nesppu.blit(tile, video, ((y - first_row) // scale, x // scale))
+
+    def render_tile(
+        self, pattern_addr: int, colors: bytes, scale: int = 1
+    ) -> npt.NDArray[np.uint32]:
+        # Tiles only depend on the CHR ROM, so the cache lives in the cartridge
+        # and is shared by all the snapshots of this console
+        self.tile_lookups += 1
+        key = (pattern_addr, colors, scale)
+        result = self.cartridge.tile_cache.get(key)
+        if result is None:
+            self.tile_misses += 1
+            result = np.zeros((8 // scale, 8 // scale), dtype=np.uint32)
+            if scale == 1:
+                nesppu.render_tile(self.cartridge.chr_rom, pattern_addr, colors, result)
+            else:
+                nesppu.render_scaled_tile(
+                    self.cartridge.chr_rom, pattern_addr, colors, result, scale
+                )
+            self.cartridge.tile_cache[key] = result
         return result
 
 
@@ -798,17 +917,26 @@ class Cpu:
     # Tracking
     frame: int = 0
     instruction_count: int = 0
+    cycle_count: int = 0
+    bus_callouts: int = 0
+    trace: nescpu.Trace | None = None
 
     # IO
     input_value: int = 0
+    input_value_2: int = 0
 
     @property
     def rom(self) -> bytes:
         return self.cartridge.prg_rom
 
+    @property
+    def block_cache(self) -> nescpu.BlockCache:
+        return self.cartridge.block_cache
+
     # CPU Bus access
 
     def cpu_read(self, addr: int) -> int:
+        self.bus_callouts += 1
         # Ram access
         if 0 <= addr < 0x0800:
             return self.ram[addr]
@@ -831,11 +959,14 @@ class Cpu:
             return result
         # Joystick 2 data
         if addr == 0x4017:
-            return 0
+            result = self.input_value_2 & 0x01
+            self.input_value_2 >>= 1
+            return result
         # Invalid access
         raise ValueError(f"Invalid read access: 0x{addr:04x} (pc=0x{self.pc:04x})")
 
     def cpu_write(self, addr: int, value: int) -> None:
+        self.bus_callouts += 1
         # Ram access
         if 0 <= addr < 0x0800:
             self.ram[addr] = value
@@ -869,8 +1000,17 @@ class Cpu:
 
     # Entry points
 
+    def copy_state(self) -> Cpu:
+        # Lightweight snapshot: the cartridge and the render caches are shared
+        state = copy(self)
+        state.ram = self.ram.copy()
+        state.ppu = self.ppu.copy_state()
+        state.apu = self.apu.copy_state()
+        return state
+
     def load_nmi_entrypoint(self) -> None:
         self.frame += 1
+        self.cycle_count += 7
         self.pc = self.cpu_read(0xFFFA)
         self.pc |= self.cpu_read(0xFFFB) << 8
 
@@ -880,16 +1020,39 @@ class Cpu:
 
     # Run CPU instructions
 
+    def run_core(self, *args: int) -> int:
+        try:
+            return nescpu.run(self, *args)
+        except ValueError as exc:
+            if self.trace is None:
+                raise
+            raise CpuFault(str(exc), self.trace.latest(CpuFault.TRACE_LENGTH)) from exc
+
     def run_instructions(self) -> None:
         jmp = 0x4C
         rti = 0x40
-        opc = nescpu.run(self)
+        opc = self.run_core()
         # Slow run
         if opc == jmp:
             raise InfiniteLoop()
         assert opc == rti
         return
 
+    def run_until(self, cycle_count: int) -> bool:
+        # Stop at the first instruction boundary where `cycle_count` is reached.
+        # Return True if the RTI has been reached, otherwise execution can be
+        # resumed with another call.
+        jmp = 0x4C
+        rti = 0x40
+        limit = -1
+        opc = self.run_core(cycle_count)
+        if opc == limit:
+            return False
+        if opc == jmp:
+            raise InfiniteLoop()
+        assert opc == rti
+        return True
+
 
 def parse_ines(source: str) -> Cartridge:
 
@@ -925,6 +1088,181 @@ def parse_ines(source: str) -> Cartridge:
     )
 
 
+def read_only_view(buffer: bytearray) -> npt.NDArray[np.uint8]:
+    view = np.frombuffer(buffer, np.uint8)
+    view.flags.writeable = False
+    return view
+
+
+@dataclass(eq=False)
+class Memory:
+    # Read-only views sharing their buffers with the emulator (no copies).
+    # They follow the emulator as it runs, but not across state loading,
+    # so they should be accessed through `Nes.memory` rather than kept around.
+    cpu: Cpu = field(repr=False)
+    video: npt.NDArray[np.uint32] | None = field(repr=False)
+
+    ram: npt.NDArray[np.uint8] = field(init=False)
+    vram: npt.NDArray[np.uint8] = field(init=False)
+    oam: npt.NDArray[np.uint8] = field(init=False)
+    palette: npt.NDArray[np.uint8] = field(init=False)
+    framebuffer: npt.NDArray[np.uint32] | None = field(init=False)
+
+    REGIONS = ("ram", "vram", "oam", "palette")
+
+    def __post_init__(self) -> None:
+        self.ram = read_only_view(self.cpu.ram)
+        self.vram = read_only_view(self.cpu.ppu.ram)
+        self.oam = read_only_view(self.cpu.ppu.oam)
+        self.palette = read_only_view(self.cpu.ppu.palette)
+        self.framebuffer = None
+        if self.video is not None:
+            self.framebuffer = self.video.view()
+            self.framebuffer.flags.writeable = False
+
+    def region(self, name: str) -> npt.NDArray[np.uint8]:
+        if name not in self.REGIONS:
+            raise ValueError(f"Invalid memory region: {name!r}")
+        result: npt.NDArray[np.uint8] = getattr(self, name)
+        return result
+
+
+@dataclass(eq=False)
+class WatchList:
+    region: str
+    addresses: npt.NDArray[np.intp]
+    previous: npt.NDArray[np.uint8]
+
+    # Addresses that changed during the last frame, with their new value
+    changes: dict[int, int] = field(default_factory=dict)
+
+    def update(self, memory: Memory) -> None:
+        current = memory.region(self.region)[self.addresses]
+        changed = np.flatnonzero(current != self.previous)
+        self.previous = current
+        if len(changed) == 0:
+            self.changes = {}
+            return
+        self.changes = dict(
+            zip(self.addresses[changed].tolist(), current[changed].tolist())
+        )
+
+
+@dataclass
+class FrameSkip:
+    period: float
+    max_skip: int = 4
+    max_lag: float = 0.25
+
+    # Pacing
+    deadline: float | None = None
+    consecutive_skips: int = 0
+
+    # Telemetry
+    lag: float = 0.0
+    peak_lag: float = 0.0
+    emulation_time: float = 0.0
+    rendered_frames: int = 0
+    skipped_frames: int = 0
+    resyncs: int = 0
+
+    def should_render(self, now: float) -> bool:
+        if self.deadline is None:
+            self.deadline = now
+        self.lag = max(0.0, now - self.deadline)
+        self.deadline += self.period
+        # Too far behind (e.g. the session was paused), start over from now
+        if self.lag > self.max_lag:
+            self.deadline = now + self.period
+            self.lag = 0.0
+            self.resyncs += 1
+        self.peak_lag = max(self.peak_lag, self.lag)
+        # Skip video while more than a frame behind, but never for too long
+        if self.lag > self.period and self.consecutive_skips < self.max_skip:
+            self.consecutive_skips += 1
+            self.skipped_frames += 1
+            return False
+        self.consecutive_skips = 0
+        self.rendered_frames += 1
+        return True
+
+    def report(self) -> dict[str, float]:
+        total = self.rendered_frames + self.skipped_frames
+        return {
+            "rendered_frames": self.rendered_frames,
+            "skipped_frames": self.skipped_frames,
+            "skip_ratio": self.skipped_frames / total if total else 0.0,
+            "lag": self.lag,
+            "peak_lag": self.peak_lag,
+            "emulation_time": self.emulation_time,
+            "resyncs": self.resyncs,
+        }
+
+
+@dataclass
+class FastForward:
+    period: float
+    ticks_in_frame: int
+    # Fraction of the period spent emulating, the rest is left to the frontend
+    budget: float = 0.6
+    max_frames: int = 16
+    # Audio chunks kept for each displayed frame, and their cross-fade length
+    grains: int = 2
+    fade: int = 1024
+    buffers: npt.NDArray[np.int16] = field(init=False, repr=False)
+
+    # Telemetry
+    displayed_frames: int = 0
+    emulated_frames: int = 0
+    last_frames: int = 0
+
+    def __post_init__(self) -> None:
+        self.buffers = np.zeros((self.max_frames, self.ticks_in_frame, 2), np.int16)
+
+    def should_continue(self, count: int, start: float, now: float) -> bool:
+        # Stop when another frame of the average duration would not fit
+        if count >= self.max_frames:
+            return False
+        average = (now - start) / count
+        return now + average <= start + self.budget * self.period
+
+    def splice_audio(self, count: int, audio: npt.NDArray[np.int16]) -> None:
+        # Time-compress the audio of `count` frames into a single frame by
+        # keeping whole chunks of it, taken from evenly spaced frames. Unlike
+        # resampling, this preserves the pitch. Each chunk keeps its position
+        # within its frame: the output starts like the first frame and ends
+        # like the last one, so consecutive calls join seamlessly. The inner
+        # seams are cross-faded with the continuation of the previous chunk
+        # to avoid clicks.
+        ticks = self.ticks_in_frame
+        grains = min(count, self.grains)
+        length = ticks // grains
+        sources = np.linspace(0, count - 1, grains).round().astype(int).tolist()
+        for index, source in enumerate(sources):
+            start = index * length
+            stop = ticks if index == grains - 1 else start + length
+            audio[start:stop] = self.buffers[source, start:stop]
+            if not index:
+                continue
+            fade = min(self.fade, stop - start)
+            ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)[:, None]
+            previous = self.buffers[sources[index - 1], start : start + fade]
+            current = self.buffers[source, start : start + fade]
+            audio[start : start + fade] = previous * (1 - ramp) + current * ramp
+        self.displayed_frames += 1
+        self.emulated_frames += count
+        self.last_frames = count
+
+    def report(self) -> dict[str, float]:
+        displayed = self.displayed_frames
+        return {
+            "displayed_frames": displayed,
+            "emulated_frames": self.emulated_frames,
+            "last_frames": self.last_frames,
+            "speed": self.emulated_frames / displayed if displayed else 0.0,
+        }
+
+
 class Nes(Console):
     WIDTH = 256
     HEIGHT = 240 - 16
@@ -944,46 +1282,352 @@ class Nes(Console):
 
     @classmethod
     def add_console_arguments(cls, parser: ArgumentParser) -> None:
-        pass
+        parser.add_argument(
+            "--frame-skip",
+            action="store_true",
+            help="Skip video rendering when the host cannot keep up",
+        )
+        parser.add_argument(
+            "--max-frame-skip",
+            type=int,
+            default=4,
+            help="Maximum number of consecutive frames to skip (default: 4)",
+        )
+        parser.add_argument(
+            "--scale",
+            type=int,
+            choices=(1, 2, 4),
+            default=1,
+            help="Render at 1/2 or 1/4 of the resolution, for small terminals",
+        )
+        parser.add_argument(
+            "--fast-forward",
+            action="store_true",
+            help="Run as fast as the host allows, with time-compressed audio",
+        )
+        parser.add_argument(
+            "--run-ahead",
+            type=int,
+            choices=range(5),
+            default=0,
+            metavar="FRAMES",
+            help="Display frames computed ahead of time to hide the input lag "
+            "of the game (default: 0)",
+        )
+        parser.add_argument(
+            "--trace",
+            action="store_true",
+            help="Trace the last executed instructions, reported on emulation errors",
+        )
+        # Process-wide options are parsed before the frontend, list them anyway
+        parser.epilog = process_arguments_help()
+        parser.formatter_class = RawDescriptionHelpFormatter
 
     def __init__(self, parser_args: Namespace) -> None:
         self.current_state = 0
         self.romfile = parser_args.romfile
-        self.cartridge = parse_ines(self.romfile)
-        self.cpu = Cpu(
-            self.cartridge,
-            Ppu(self.cartridge),
-            Apu(),
-        )
-        # Run RST
-        self.cpu.load_rst_entrypoint()
-        try:
-            self.cpu.run_instructions()
-        except InfiniteLoop:
-            pass
+        # The frontend allocates the video buffer from those dimensions
+        self.scale: int = getattr(parser_args, "scale", 1)
+        self.WIDTH = Nes.WIDTH // self.scale
+        self.HEIGHT = Nes.HEIGHT // self.scale
+        self.frame_skip: FrameSkip | None = None
+        if getattr(parser_args, "frame_skip", False):
+            self.frame_skip = FrameSkip(
+                1 / self.FPS, max_skip=getattr(parser_args, "max_frame_skip", 4)
+            )
+        self.fast_forward: FastForward | None = None
+        self.set_fast_forward(getattr(parser_args, "fast_forward", False))
+        # Latest controller values, the CPU shifts them out when they are read
+        self.controllers = (0, 0)
+        self.run_ahead = 0
+        self.run_ahead_audio: npt.NDArray[np.int16] | None = None
+        self.set_run_ahead(getattr(parser_args, "run_ahead", 0))
+        self.metrics = self.create_metrics()
+        REGISTRY.register(self, self.metrics)
+        self.last_video = None
+        self.cached_memory: Memory | None = None
+        self.watch_lists: list[WatchList] = []
+        self.recorder: Recorder | None = None
+        self.recorder_finalizer: weakref.finalize[[], Nes] | None = None
+        # Start from the pre-warmed state shared by all the sessions of this ROM
+        template = SessionTemplate.get(self.romfile)
+        self.cartridge = template.cartridge
+        self.cpu = template.spawn()
+        self.trace: nescpu.Trace | None = None
+        if getattr(parser_args, "trace", False):
+            self.start_trace()
+        recording_path = new_recording_path()
+        if recording_path is not None:
+            self.start_recording(recording_path)
+
+    @staticmethod
+    def create_metrics() -> Metrics:
+        metrics = Metrics()
+        for name in ("frames", "frames_rendered", "frames_skipped"):
+            metrics.add_counter(name)
+        metrics.add_counter("frame_skip_resyncs")
+        metrics.add_histogram("frame_lag_seconds", FRAME_TIME_BUCKETS)
+        for name in ("tile_cache_hits", "tile_cache_misses"):
+            metrics.add_counter(name)
+        for name in ("frame_seconds", "cpu_seconds", "render_seconds", "audio_seconds"):
+            metrics.add_histogram(name, FRAME_TIME_BUCKETS)
+        for name in ("bus_callouts", "tiles_redrawn"):
+            metrics.add_histogram(name, COUNT_BUCKETS)
+        for name in ("state_save_seconds", "state_load_seconds"):
+            metrics.add_histogram(name, DURATION_BUCKETS)
+        return metrics
 
     @property
     def apu(self) -> Apu:
         return self.cpu.apu
 
+    @property
+    def memory(self) -> Memory:
+        # Views are rebuilt whenever the console state or the video buffer
+        # are replaced, so they are cheap to access every frame
+        memory = self.cached_memory
+        if (
+            memory is None
+            or memory.cpu is not self.cpu
+            or (memory.video is not self.last_video)
+        ):
+            memory = self.cached_memory = Memory(self.cpu, self.last_video)
+        return memory
+
+    def watch(self, addresses: Iterable[int], region: str = "ram") -> WatchList:
+        indexes = np.array(list(addresses), dtype=np.intp)
+        previous = self.memory.region(region)[indexes]
+        watch_list = WatchList(region, indexes, previous)
+        self.watch_lists.append(watch_list)
+        return watch_list
+
+    def unwatch(self, watch_list: WatchList) -> None:
+        self.watch_lists.remove(watch_list)
+
+    def update_watch_lists(self) -> None:
+        if not self.watch_lists:
+            return
+        memory = self.memory
+        for watch_list in self.watch_lists:
+            watch_list.update(memory)
+
     @property
     def ppu(self) -> Ppu:
         return self.cpu.ppu
 
+    def start_trace(self, capacity: int = 65536) -> nescpu.Trace:
+        self.trace = self.cpu.trace = nescpu.Trace(capacity)
+        return self.trace
+
+    def stop_trace(self) -> None:
+        self.trace = self.cpu.trace = None
+
+    def start_recording(
+        self,
+        path: str | os.PathLike[str],
+        keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL,
+    ) -> None:
+        self.stop_recording()
+        self.recorder = Recorder.open(
+            path,
+            self.HEIGHT,
+            self.WIDTH,
+            self.TICKS_IN_FRAME,
+            self.FPS,
+            keyframe_interval,
+        )
+        # Make sure the index gets written even if the session is not closed
+        self.recorder_finalizer = weakref.finalize(self, self.recorder.close)
+
+    def stop_recording(self) -> None:
+        if self.recorder_finalizer is not None:
+            self.recorder_finalizer()
+        self.recorder = None
+        self.recorder_finalizer = None
+
+    def set_fast_forward(self, enabled: bool) -> None:
+        if not enabled:
+            self.fast_forward = None
+        elif self.fast_forward is None:
+            self.fast_forward = FastForward(1 / self.FPS, self.TICKS_IN_FRAME)
+
+    def toggle_fast_forward(self) -> None:
+        self.set_fast_forward(self.fast_forward is None)
+
+    def set_run_ahead(self, frames: int) -> None:
+        self.run_ahead = frames
+        # The audio of the speculative frames is discarded
+        if frames and self.run_ahead_audio is None:
+            self.run_ahead_audio = np.zeros((self.TICKS_IN_FRAME, 2), np.int16)
+
     def set_input(self, input_set: set[Console.Input]) -> None:
         value = sum(self.INPUT_MAP.get(key, 0) for key in input_set)
         self.cpu.input_value = value
+        self.controllers = value, self.controllers[1]
+
+    def set_controllers(self, value_1: int, value_2: int = 0) -> None:
+        self.cpu.input_value = value_1 & 0xFF
+        self.cpu.input_value_2 = value_2 & 0xFF
+        self.controllers = value_1 & 0xFF, value_2 & 0xFF
 
     def advance_one_frame(
         self, video: npt.NDArray[np.uint32], audio: npt.NDArray[np.int16]
     ) -> tuple[bool, int]:
+        if self.fast_forward is not None:
+            return self.advance_fast_forward(video, audio)
+        start = time.perf_counter()
+        render = self.frame_skip is None or self.record_lag(self.frame_skip, start)
+        self.last_video = video
+        self.cpu.bus_callouts = 0
         self.ppu.new_vblank()
         self.cpu.load_nmi_entrypoint()
         self.cpu.run_instructions()
-        self.ppu.render(video)
+        cpu_done = time.perf_counter()
+        # Skipped frames keep their tile changes for the next render
+        if render and self.run_ahead:
+            self.render_ahead(video)
+        elif render:
+            self.ppu.render(video, self.scale)
+        render_done = time.perf_counter()
         self.apu.generate(audio)
+        stop = time.perf_counter()
+        if self.frame_skip is not None:
+            self.frame_skip.emulation_time = stop - start
+        self.record_frame(render, start, cpu_done, render_done, stop)
+        self.update_watch_lists()
+        if self.recorder is not None:
+            self.recorder.write_frame(video, audio[: self.TICKS_IN_FRAME])
+        return render, self.TICKS_IN_FRAME
+
+    def advance_fast_forward(
+        self, video: npt.NDArray[np.uint32], audio: npt.NDArray[np.int16]
+    ) -> tuple[bool, int]:
+        # Run as many frames as the budget allows and display the last one,
+        # the frontend keeps pacing the calls at the normal rate
+        fast_forward = self.fast_forward
+        assert fast_forward is not None
+        start = time.perf_counter()
+        count = 0
+        while True:
+            self.cpu.input_value, self.cpu.input_value_2 = self.controllers
+            self.cpu.bus_callouts = 0
+            self.emulate_frame(None, fast_forward.buffers[count], update_tiles=False)
+            count += 1
+            cpu_done = time.perf_counter()
+            if not fast_forward.should_continue(count, start, cpu_done):
+                break
+        self.last_video = video
+        self.ppu.render(video, self.scale)
+        render_done = time.perf_counter()
+        fast_forward.splice_audio(count, audio)
+        stop = time.perf_counter()
+        self.record_frame(True, start, cpu_done, render_done, stop)
+        # Watchers only see the displayed frame
+        self.update_watch_lists()
+        self.metrics.increment("frames", count - 1)
+        self.metrics.increment("frames_skipped", count - 1)
+        if self.recorder is not None:
+            self.recorder.write_frame(video, audio[: self.TICKS_IN_FRAME])
         return True, self.TICKS_IN_FRAME
 
+    def emulate_frame(
+        self,
+        video: npt.NDArray[np.uint32] | None = None,
+        audio: npt.NDArray[np.int16] | None = None,
+        update_tiles: bool = True,
+    ) -> None:
+        # Headless variant of `advance_one_frame`, without pacing nor metrics.
+        # Callers update the watch lists for the frames that are actually kept.
+        self.ppu.new_vblank()
+        self.cpu.load_nmi_entrypoint()
+        self.cpu.run_instructions()
+        if video is not None:
+            self.last_video = video
+            self.ppu.render(video, self.scale)
+        # Otherwise the tile changes are kept for the next render
+        elif update_tiles:
+            self.ppu.update_tiles()
+        if audio is not None:
+            self.apu.generate(audio)
+
+    def render_ahead(self, video: npt.NDArray[np.uint32]) -> None:
+        # Run the next frames with the current input and display the last one,
+        # then go back to the real state. The game reacts to the input on the
+        # displayed frame instead of a few frames later.
+        assert self.run_ahead_audio is not None
+        state = self.quick_save()
+        self.cpu.trace = None
+        for _ in range(self.run_ahead):
+            self.apu.generate(self.run_ahead_audio)
+            self.cpu.input_value, self.cpu.input_value_2 = self.controllers
+            self.ppu.new_vblank()
+            self.cpu.load_nmi_entrypoint()
+            self.cpu.run_instructions()
+        self.ppu.render(video, self.scale)
+        speculative_ppu = self.ppu
+        # Also restores the trace, and marks the tiles drawn from speculative
+        # contents for the next render
+        self.quick_load(state)
+        self.ppu.tiles_redrawn = speculative_ppu.tiles_redrawn
+        self.ppu.tile_lookups = speculative_ppu.tile_lookups
+        self.ppu.tile_misses = speculative_ppu.tile_misses
+
+    def copy_cpu(self, cpu: Cpu) -> Cpu:
+        # The cartridge is immutable and shared with the copy,
+        # the trace belongs to the console and is left out
+        memo: dict[int, Any] = {id(self.cartridge): self.cartridge}
+        if cpu.trace is not None:
+            memo[id(cpu.trace)] = None
+        return deepcopy(cpu, memo)
+
+    def snapshot(self) -> Cpu:
+        return self.copy_cpu(self.cpu)
+
+    def restore(self, snapshot: Cpu) -> None:
+        cpu = self.copy_cpu(snapshot)
+        cpu.trace = self.trace
+        self.cpu = cpu
+
+    def quick_save(self) -> Cpu:
+        # Cheaper than `snapshot`, meant for in-memory rewinding
+        return self.cpu.copy_state()
+
+    def quick_load(self, state: Cpu) -> None:
+        # The state is copied again so it can be loaded several times
+        cpu = state.copy_state()
+        cpu.ppu.adopt_tile_cache(self.ppu)
+        cpu.trace = self.trace
+        self.cpu = cpu
+
+    def record_lag(self, frame_skip: FrameSkip, start: float) -> bool:
+        resyncs = frame_skip.resyncs
+        render = frame_skip.should_render(start)
+        self.metrics.observe("frame_lag_seconds", frame_skip.lag)
+        self.metrics.increment("frame_skip_resyncs", frame_skip.resyncs - resyncs)
+        return render
+
+    def record_frame(
+        self,
+        rendered: bool,
+        start: float,
+        cpu_done: float,
+        render_done: float,
+        stop: float,
+    ) -> None:
+        metrics = self.metrics
+        metrics.increment("frames")
+        metrics.increment("frames_rendered" if rendered else "frames_skipped")
+        metrics.observe("frame_seconds", stop - start)
+        metrics.observe("cpu_seconds", cpu_done - start)
+        metrics.observe("render_seconds", render_done - cpu_done)
+        metrics.observe("audio_seconds", stop - render_done)
+        metrics.observe("bus_callouts", self.cpu.bus_callouts)
+        metrics.observe("tiles_redrawn", self.ppu.tiles_redrawn)
+        metrics.increment("tile_cache_misses", self.ppu.tile_misses)
+        metrics.increment(
+            "tile_cache_hits", self.ppu.tile_lookups - self.ppu.tile_misses
+        )
+
     def set_current_state(self, state: int) -> None:
         self.current_state = state % 10
 
@@ -991,6 +1635,7 @@ class Nes(Console):
         return self.current_state
 
     def load_state(self) -> None:
+        start = time.perf_counter()
         path = f"{self.romfile}.{self.current_state}.state"
         try:
             with open(path, "rb") as f:
@@ -999,19 +1644,109 @@ class Nes(Console):
             return
         cpu.cartridge = self.cartridge
         cpu.ppu.cartridge = self.cartridge
+        cpu.trace = self.trace
         self.cpu = cpu
+        self.metrics.observe("state_load_seconds", time.perf_counter() - start)
 
     def save_state(self) -> None:
+        start = time.perf_counter()
         path = f"{self.romfile}.{self.current_state}.state"
-        cpu = deepcopy(self.cpu)
+        cpu = self.snapshot()
         del cpu.cartridge
         del cpu.ppu.cartridge
         with open(path, "wb") as f:
             f.write(zlib.compress(pickle.dumps(cpu)))
+        self.metrics.observe("state_save_seconds", time.perf_counter() - start)
+
+
+@dataclass(eq=False)
+class SessionTemplate:
+    # Fully initialized console for a given ROM. The cartridge (along with its
+    # block and tile caches) is shared by all the sessions of the process, and
+    # inherited copy-on-write by forked workers.
+    cartridge: Cartridge
+    initial_state: Cpu
+
+    WARM_FRAMES: ClassVar[int] = 60
+    TEMPLATES: ClassVar[dict[str, tuple[tuple[int, int], SessionTemplate]]] = {}
+    # Templates are built under a per-ROM lock, so that building one does not
+    # delay the first sessions of other ROMs
+    LOCK: ClassVar[threading.Lock] = threading.Lock()
+    PATH_LOCKS: ClassVar[dict[str, threading.Lock]] = {}
+
+    @classmethod
+    def get(cls, romfile: str | os.PathLike[str]) -> SessionTemplate:
+        # Templates are rebuilt if the ROM file changes on disk
+        path = os.path.realpath(romfile)
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with cls.LOCK:
+            path_lock = cls.PATH_LOCKS.setdefault(path, threading.Lock())
+        with path_lock:
+            item = cls.TEMPLATES.get(path)
+            if item is None or item[0] != stamp:
+                item = cls.TEMPLATES[path] = (stamp, cls.from_romfile(path))
+        return item[1]
+
+    @classmethod
+    def from_romfile(cls, romfile: str) -> SessionTemplate:
+        cartridge = parse_ines(romfile)
+        cpu = Cpu(
+            cartridge,
+            Ppu(cartridge),
+            Apu(),
+        )
+        # Run RST
+        cpu.load_rst_entrypoint()
+        try:
+            cpu.run_instructions()
+        except InfiniteLoop:
+            pass
+        template = cls(cartridge, cpu)
+        template.warm(cls.WARM_FRAMES)
+        return template
+
+    def spawn(self) -> Cpu:
+        return deepcopy(self.initial_state, {id(self.cartridge): self.cartridge})
+
+    def warm(self, frames: int) -> None:
+        # Run a throwaway copy to decode the hot code and render the common tiles.
+        # Warming stops at the first error, sessions then start from the fresh
+        # console and report the error themselves when they reach it.
+        cpu = self.spawn()
+        video = np.zeros((Nes.HEIGHT, Nes.WIDTH), np.uint32)
+        for _ in range(frames):
+            cpu.ppu.new_vblank()
+            cpu.load_nmi_entrypoint()
+            try:
+                cpu.run_instructions()
+                cpu.ppu.render(video)
+            except Exception:
+                return
+
+
+def process_arguments_help() -> str:
+    parser = ArgumentParser(add_help=False, usage=SUPPRESS)
+    add_recording_arguments(parser.add_argument_group("recording options"))
+    add_metrics_arguments(parser.add_argument_group("metrics options"))
+    header = (
+        "The following options apply to the whole process, they are only\n"
+        "accepted on the famiterm and famiterm-ssh command lines:"
+    )
+    return f"{header}\n\n{parser.format_help()}"
 
 
 def main(parser_args: tuple[str, ...] | None = None) -> None:
-    gambaterm_main(parser_args, console_cls=Nes)
+    recording_args, parser_args = split_recording_arguments(parser_args)
+    configure_recording(recording_args)
+    metrics_args, parser_args = split_metrics_arguments(parser_args)
+    exporter = start_metrics_export(metrics_args)
+    try:
+        gambaterm_main(parser_args, console_cls=Nes)
+    finally:
+        if exporter is not None:
+            exporter.stop()
+            exporter.export()
 
 
 if __name__ == "__main__":
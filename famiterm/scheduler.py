@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+
+import numpy as np
+import numpy.typing as npt
+from gambaterm.console import Console
+
+from .metrics import FRAME_TIME_BUCKETS
+from .run import Nes
+
+FrameCallback = Callable[["Session"], None]
+
+# Number of recent frames used for the jitter statistics
+JITTER_WINDOW = 600
+
+
+@dataclass(eq=False)
+class Session:
+    nes: Nes
+    on_frame: FrameCallback | None = None
+    video: npt.NDArray[np.uint32] = field(init=False, repr=False)
+    audio: npt.NDArray[np.int16] = field(init=False, repr=False)
+
+    # Scheduling
+    deadline: float = 0.0
+    active: bool = True
+    pending_input: set[Console.Input] | None = None
+    # Exception that stopped the session, if any
+    error: Exception | None = None
+
+    # Telemetry
+    frames: int = 0
+    coalesced_inputs: int = 0
+    resyncs: int = 0
+    peak_lateness: float = 0.0
+    last_start: float | None = None
+    lateness: deque[float] = field(
+        default_factory=lambda: deque(maxlen=JITTER_WINDOW), repr=False
+    )
+    intervals: deque[float] = field(
+        default_factory=lambda: deque(maxlen=JITTER_WINDOW), repr=False
+    )
+
+    def __post_init__(self) -> None:
+        # Same buffers as the terminal frontend
+        self.video = np.zeros((self.nes.HEIGHT, self.nes.WIDTH), np.uint32)
+        self.audio = np.zeros((2 * self.nes.TICKS_IN_FRAME, 2), np.int16)
+        self.nes.metrics.add_histogram("frame_lateness_seconds", FRAME_TIME_BUCKETS)
+
+    def set_input(self, input_set: Iterable[Console.Input]) -> None:
+        # Only the latest input before the next frame matters
+        if self.pending_input is not None:
+            self.coalesced_inputs += 1
+        self.pending_input = set(input_set)
+
+    def record(self, start: float) -> None:
+        lateness = max(0.0, start - self.deadline)
+        self.lateness.append(lateness)
+        self.peak_lateness = max(self.peak_lateness, lateness)
+        if self.last_start is not None:
+            self.intervals.append(start - self.last_start)
+        self.last_start = start
+        self.frames += 1
+        self.nes.metrics.observe("frame_lateness_seconds", lateness)
+
+    def report(self) -> dict[str, float]:
+        lateness = np.array(self.lateness)
+        intervals = np.array(self.intervals)
+        result = {
+            "frames": self.frames,
+            "coalesced_inputs": self.coalesced_inputs,
+            "resyncs": self.resyncs,
+            "failed": int(self.error is not None),
+            "peak_lateness": self.peak_lateness,
+            "lateness_mean": 0.0,
+            "lateness_p50": 0.0,
+            "lateness_p99": 0.0,
+            "interval_mean": 0.0,
+            "interval_jitter": 0.0,
+        }
+        if len(lateness):
+            result["lateness_mean"] = float(lateness.mean())
+            result["lateness_p50"] = float(np.percentile(lateness, 50))
+            result["lateness_p99"] = float(np.percentile(lateness, 99))
+        if len(intervals):
+            result["interval_mean"] = float(intervals.mean())
+            result["interval_jitter"] = float(intervals.std())
+        return result
+
+
+class SessionScheduler:
+    # Run many consoles in a single event loop. Each session has its own
+    # frame deadline and the session with the earliest deadline always runs
+    # first, so that a slow frame delays every session by the same amount
+    # instead of the sessions that happen to be stepped last. Control goes
+    # back to the event loop between two frames.
+
+    def __init__(self, fps: float = Nes.FPS, max_lag: float = 0.25) -> None:
+        self.period = 1 / fps
+        self.max_lag = max_lag
+        self.sessions: set[Session] = set()
+        self.queue: list[tuple[float, int, Session]] = []
+        self.counter = itertools.count()
+        self.wakeup: asyncio.Event | None = None
+        self.stopped = False
+        # Sessions removed after an error, still reported
+        self.failed: list[Session] = []
+
+    def add(self, nes: Nes, on_frame: FrameCallback | None = None) -> Session:
+        session = Session(nes, on_frame)
+        session.deadline = time.perf_counter()
+        self.sessions.add(session)
+        self.push(session)
+        self.wake()
+        return session
+
+    def remove(self, session: Session) -> None:
+        # Removed sessions are dropped from the queue lazily
+        session.active = False
+        self.sessions.discard(session)
+
+    def stop(self) -> None:
+        self.stopped = True
+        self.wake()
+
+    def push(self, session: Session) -> None:
+        heapq.heappush(self.queue, (session.deadline, next(self.counter), session))
+
+    def wake(self) -> None:
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def wait(self, timeout: float | None) -> None:
+        assert self.wakeup is not None
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self) -> None:
+        # The event is created here to be bound to the running loop
+        self.wakeup = asyncio.Event()
+        self.stopped = False
+        while not self.stopped:
+            while self.queue and not self.queue[0][2].active:
+                heapq.heappop(self.queue)
+            if not self.queue:
+                await self.wait(None)
+                continue
+            deadline, _, session = self.queue[0]
+            delay = deadline - time.perf_counter()
+            # Woken up early if a session is added or the scheduler stopped
+            if delay > 0:
+                await self.wait(delay)
+                continue
+            heapq.heappop(self.queue)
+            self.step(session)
+            if session.active:
+                self.push(session)
+            await asyncio.sleep(0)
+
+    def step(self, session: Session) -> None:
+        # An error only stops the session that raised it
+        try:
+            self.run_frame(session)
+        except Exception as exc:
+            session.error = exc
+            self.failed.append(session)
+            self.remove(session)
+
+    def run_frame(self, session: Session) -> None:
+        start = time.perf_counter()
+        session.record(start)
+        if session.pending_input is not None:
+            session.nes.set_input(session.pending_input)
+            session.pending_input = None
+        session.nes.advance_one_frame(session.video, session.audio)
+        session.deadline += self.period
+        # Too far behind (e.g. the process was suspended), start over from now
+        if start - session.deadline > self.max_lag:
+            session.deadline = time.perf_counter() + self.period
+            session.resyncs += 1
+        if session.on_frame is not None:
+            session.on_frame(session)
+
+    def report(self) -> dict[Session, dict[str, float]]:
+        sessions = itertools.chain(self.sessions, self.failed)
+        return {session: session.report() for session in sessions}
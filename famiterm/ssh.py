@@ -1,8 +1,20 @@
 from __future__ import annotations
 
 from .run import Nes
+from .metrics import split_metrics_arguments, start_metrics_export
+from .recording import configure_recording, split_recording_arguments
 from gambaterm.ssh import main as gambaterm_ssh_main
 
 
 def main(parser_args: tuple[str, ...] | None = None) -> None:
-    gambaterm_ssh_main(parser_args, console_cls=Nes)
+    # Sessions run as threads of this process and share the metrics registry
+    recording_args, parser_args = split_recording_arguments(parser_args)
+    configure_recording(recording_args)
+    metrics_args, parser_args = split_metrics_arguments(parser_args)
+    exporter = start_metrics_export(metrics_args)
+    try:
+        gambaterm_ssh_main(parser_args, console_cls=Nes)
+    finally:
+        if exporter is not None:
+            exporter.stop()
+            exporter.export()
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import re
+from collections.abc import Iterable
+
+import numpy as np
+import numpy.typing as npt
+
+from .nescpu import TRACE_DTYPE
+
+TraceRecords = npt.NDArray[np.void]
+
+# The core only keeps track of the N, V, Z and C flags
+TRACE_FLAGS_MASK = 0xC3
+
+# Matches our own format as well as nestest.log lines, e.g.
+# C000  4C F5 C5  JMP $C5F5     A:00 X:00 Y:00 P:24 SP:FD PPU:  0, 21 CYC:7
+TRACE_LINE = re.compile(
+    r"^(?P<pc>[0-9A-F]{4})\s+(?P<opcode>[0-9A-F]{2})\b.*?"
+    r"A:(?P<a>[0-9A-F]{2}) X:(?P<x>[0-9A-F]{2}) Y:(?P<y>[0-9A-F]{2}) "
+    r"P:(?P<p>[0-9A-F]{2}) SP:(?P<sp>[0-9A-F]{2})"
+    r"(?:.*?CYC:\s*(?P<cycle_count>\d+))?"
+    r"(?:.*?IC:\s*(?P<instruction_count>\d+))?"
+)
+
+
+def format_record(record: np.void) -> str:
+    return (
+        f"{record['pc']:04X}  {record['opcode']:02X}  "
+        f"A:{record['a']:02X} X:{record['x']:02X} Y:{record['y']:02X} "
+        f"P:{record['p']:02X} SP:{record['sp']:02X} "
+        f"CYC:{record['cycle_count']} IC:{record['instruction_count']}"
+    )
+
+
+def format_records(records: TraceRecords) -> str:
+    return "\n".join(format_record(record) for record in records)
+
+
+def parse_trace(lines: Iterable[str]) -> TraceRecords:
+    # Parse a text trace, either dumped by `format_records` or a reference
+    # log such as nestest.log. Unknown counters are left to zero.
+    rows = []
+    for line in lines:
+        match = TRACE_LINE.match(line)
+        if match is None:
+            continue
+        groups = match.groupdict()
+        rows.append(
+            (
+                int(groups["cycle_count"] or 0),
+                int(groups["instruction_count"] or 0),
+                int(groups["pc"], 16),
+                int(groups["opcode"], 16),
+                int(groups["a"], 16),
+                int(groups["x"], 16),
+                int(groups["y"], 16),
+                int(groups["sp"], 16),
+                int(groups["p"], 16),
+            )
+        )
+    return np.array(rows, dtype=TRACE_DTYPE)
+
+
+def compare_traces(
+    records: TraceRecords,
+    reference: TraceRecords,
+    flags_mask: int = TRACE_FLAGS_MASK,
+    compare_cycles: bool = True,
+) -> int | None:
+    # Return the index of the first diverging record, or None if the traces
+    # match over their common length. Cycle counts are compared relative to
+    # the first record, since reference logs such as nestest.log start at
+    # CYC:7 while the core counts from 0.
+    size = min(len(records), len(reference))
+    records = records[:size]
+    reference = reference[:size]
+    mismatch = np.zeros(size, dtype=bool)
+    for name in ("pc", "opcode", "a", "x", "y", "sp"):
+        mismatch |= records[name] != reference[name]
+    mismatch |= (records["p"] & flags_mask) != (reference["p"] & flags_mask)
+    if compare_cycles and size:
+        cycles = records["cycle_count"].astype(np.int64)
+        reference_cycles = reference["cycle_count"].astype(np.int64)
+        mismatch |= cycles - cycles[0] != reference_cycles - reference_cycles[0]
+    indexes = np.flatnonzero(mismatch)
+    return int(indexes[0]) if len(indexes) else None